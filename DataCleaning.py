@@ -2,237 +2,632 @@
 """
 Data import, cleaning, and feature engineering for LMP Data
 
+Run with --incremental to only recompute the hours that changed since the last run of the
+feature table instead of rebuilding it from scratch, or with --interval to build the 5-minute
+feature table instead of the hourly one. The hourly source stages are cached in
+Cleaned_Data/stage_cache and only rebuilt when their raw data or code changes.
+
 """
 import pandas as pd
 import numpy as np
-import glob
-from datetime import datetime, timedelta, timezone, date
-from functools import reduce
-import requests
-from io import StringIO 
+import os
+import sys
+from io import BytesIO
+from raw_store import read_query
+from hourly_aggregation import hourly_means
+from hourly_join import align_hourly_sources
+from fast_pivot import pivot_long_to_wide
+from feature_engineering import create_shifted_columns, create_panel_shifted_columns, spike_flags, calendar_features
+from stage_cache import cached_stage
+from rolling_features import rolling_features, ROLLING_WINDOWS
+from data_validation import validate, validate_raw, component_sum_rule, range_rule, coverage_rule, RAW_INTERVALS
+
+
+FEATURE_TABLE_PATH = './Cleaned_Data/LMP_and_feature_data.csv'
+GAP_REPORT_PATH = './Cleaned_Data/gap_report.csv'
+VALIDATION_REPORT_PATH = './Cleaned_Data/validation_report.csv'
+INTERVAL_TABLE_PATH = './Cleaned_Data/LMP_and_feature_data_5min.parquet'
+
+# Pricing node of the single-node feature table. The raw store may hold other nodes for the panel
+NODE = 'PACFCBCH_6_N004'
 
 
 ##### Import all LMP files and combine into a single DataFrame #####
 
-# Create function for concatenating multiple csv's into one dataframe
-
-def create_mult_csv_df(filepath):
-    """Loops through folder specified in filepath and returns a df that concatenates all csv's in that file"""
-    
-    # Create list to store df's from each individual df
-    temp_df_list = []
-    
-    # Create path that searches for all csv's in folder
-    search_path = filepath + "*csv" 
-    
-    # Add df's from individual csv's to list
-    for file in glob.glob(search_path):
-        temp_df = pd.read_csv(file)
-        temp_df_list.append(temp_df)
-        
-    df = pd.concat(temp_df_list) # Combine all df's
-    df.reset_index(inplace=True)
-    
-    return df
-    
+## First Import RTLMP ##
 
-def utc_to_local(utc_dt):
-    """Converts UTC timezone to PST Time"""
-    return utc_dt.replace(tzinfo=timezone.utc).astimezone(tz='America/Los_Angeles')
+@cached_stage('PRC_INTVL_LMP')
+def load_hourly_rt(start=None, end=None):
+    """Returns hourly averages of the 5-minute real-time prices between start and end (UTC)"""
+    # The data download from CAISO contains multiple types of prices. Average each type by hour,
+    # streaming through the 5-minute intervals so they never need to be held in memory at once
+    hourly_rt_df = hourly_means('PRC_INTVL_LMP', label_col='LMP_TYPE', value_col='VALUE', start=start, end=end,
+                                where={'NODE': [NODE]})
 
+    # Add prefix to cols for merging later
+    hourly_rt_df.columns = ["RT_" + col for col in hourly_rt_df.columns]
 
+    return hourly_rt_df
 
-## First Import RTLMP ##    
 
-rt_df = create_mult_csv_df("./Raw_Data/PACFCBCH_Interval_LMP/")
+## Now import DALMP ##
 
+@cached_stage('PRC_LMP')
+def load_da(start=None, end=None):
+    """Returns hourly day-ahead prices between start and end (UTC)"""
+    da_df = read_query('PRC_LMP', columns=['INTERVALSTARTTIME_GMT', 'LMP_TYPE', 'MW'], start=start, end=end,
+                       where={'NODE': [NODE]})
 
-# Convert starting datetime to datetime type and add new PST version
-rt_df['INTERVALSTARTTIME_GMT'] = pd.to_datetime(rt_df['INTERVALSTARTTIME_GMT'] )
+    # Convert starting datetime to datetime type and create PST datetime
+    da_df['INTERVALSTARTTIME_GMT'] = pd.to_datetime(da_df['INTERVALSTARTTIME_GMT'])
 
-# The data download from CAISO contains multiple types of prices. Convert from long to wide format
-rt_df = rt_df.pivot(index='INTERVALSTARTTIME_GMT', columns='LMP_TYPE', values='VALUE')
+    da_df = pivot_long_to_wide(da_df, index='INTERVALSTARTTIME_GMT', columns='LMP_TYPE', values='MW')
 
-# Add prefix to cols for merging later
-rt_df.columns = ["RT_" + col for col in rt_df.columns]
+    # Add prefix to cols for merging later
+    da_df.columns = ["DA_" + col for col in da_df.columns]
 
-# Create hourly summary to merge wwith DA dataset
-hourly_rt_df = rt_df.groupby(rt_df.index.floor("H")).mean()
-    
-# Checking that LMP is roughly equivalent to the sum of all other lmp components at a given time
-sum((rt_df['RT_LMP'] - rt_df[['RT_MCC', 'RT_MCE', 'RT_MCL', 'RT_MGHG']].sum(axis=1)) < 0.001) / rt_df.shape[0]
+    return da_df
 
 
-## Now import DALMP ##
+## CAISO Load ##
 
-da_df = create_mult_csv_df("./Raw_Data/PACFCBCH_DA_LMP/")
+@cached_stage('ENE_SLRS')
+def load_hourly_load(start=None, end=None):
+    """Returns hourly averages of CAISO-wide export, generation, import and load between start and end (UTC)"""
+    # FIltering for only total CAISO load for now
+    # Getting hourly averages with import/gen/export as columns
+    hourly_load_df = hourly_means('ENE_SLRS', label_col='SCHEDULE', value_col='MW', start=start, end=end,
+                                  where={'TAC_ZONE_NAME': ['Caiso_Totals']})
 
-# Convert starting datetime to datetime type and create PST datetime
-da_df['INTERVALSTARTTIME_GMT'] = pd.to_datetime(da_df['INTERVALSTARTTIME_GMT'])
+    return hourly_load_df
 
-da_df = da_df.pivot(index = 'INTERVALSTARTTIME_GMT', columns='LMP_TYPE', values='MW')
 
-# Add prefix to cols for merging later
-da_df.columns = ["DA_" + col for col in da_df.columns]
+## Wind and Solar Forecast ##
 
+@cached_stage('SLD_REN_FCST')
+def load_renew_forecast(start=None, end=None):
+    """Returns hourly day-ahead forecast and actual wind / solar generation by hub between start and end (UTC)"""
+    renew_forecast_df = read_query('SLD_REN_FCST',
+                                   columns=['INTERVALSTARTTIME_GMT', 'TRADING_HUB', 'RENEWABLE_TYPE', 'LABEL', 'MW'],
+                                   start=start, end=end,
+                                   where={'LABEL': ['Renewable Forecast Day Ahead', 'Renewable Forecast Actual Generation']})
 
-## CAISO Load ##
+    renew_forecast_df['INTERVALSTARTTIME_GMT'] = pd.to_datetime(renew_forecast_df['INTERVALSTARTTIME_GMT'])
 
-load_df = create_mult_csv_df("./Raw_Data/CAISO_LOAD/")
+    # Pivoting on hub, renewable type and market
 
-load_df['INTERVALSTARTTIME_GMT'] = pd.to_datetime(load_df['INTERVALSTARTTIME_GMT'])
+    # Column names are the hub, type and label joined with "_"
+    renew_forecast_df = pivot_long_to_wide(renew_forecast_df, index='INTERVALSTARTTIME_GMT',
+                                           columns=["TRADING_HUB", "RENEWABLE_TYPE", "LABEL"], values="MW", sep="_")
 
-# FIltering for only total CAISO load for now
-load_df = load_df[load_df['TAC_ZONE_NAME'] == 'Caiso_Totals']
+    return renew_forecast_df
 
-# Getting wide data with import/gen/export as columns
-load_df = load_df.pivot(index='INTERVALSTARTTIME_GMT', columns='SCHEDULE', values='MW')
 
-# Create hourly summary to merge wwith DA dataset
-hourly_load_df = load_df.groupby(load_df.index.floor("H")).mean()
+# Adding Weather Data
 
+@cached_stage('WEATHER')
+def load_weather(start=None, end=None):
+    """Returns hourly temperature between start and end (UTC)"""
+    return read_query('WEATHER', start=start, end=end).set_index('INTERVALSTARTTIME_GMT')
 
-## Wind and Solar Forecast ##
 
-renew_forecast_df = create_mult_csv_df("./Raw_Data/Wind_Solar_Forecast/")
+def load_sources(start=None, end=None):
+    """Returns the hourly source DataFrames (RT, DA, load, renewables, weather) between start and end (UTC) by name"""
+    return {'hourly_rt': load_hourly_rt(start, end),
+            'da': load_da(start, end),
+            'hourly_load': load_hourly_load(start, end),
+            'renew_forecast': load_renew_forecast(start, end),
+            'weather': load_weather(start, end)}
+
 
-renew_forecast_df['INTERVALSTARTTIME_GMT'] = pd.to_datetime(renew_forecast_df['INTERVALSTARTTIME_GMT'])
+# Create Hourly DataFrame
 
-renew_forecast_df = renew_forecast_df[renew_forecast_df['LABEL'].isin(['Renewable Forecast Day Ahead', 'Renewable Forecast Actual Generation'])]
+def merge_sources(sources, gap_report_path=None):
+    """
+    Inner joins the hourly sources on their UTC index and converts the index to local time.
 
-# Pivoting on hub, renewable type and market
+    Hours missing from any source are dropped. If gap_report_path is given, the dropped hours and
+    the sources they are missing from are written there as a csv.
+    """
+    df, gap_report = align_hourly_sources(sources, how='inner')
 
-renew_forecast_df = renew_forecast_df.pivot(index='INTERVALSTARTTIME_GMT', columns=["TRADING_HUB", "RENEWABLE_TYPE", "LABEL"], values="MW")
+    if len(gap_report):
+        print(f"Dropped {len(gap_report)} hours missing from at least one source:")
+        print(gap_report.sum().to_string())
+    if gap_report_path is not None:
+        gap_report.to_csv(gap_report_path)
 
-renew_forecast_df.columns = ["_".join(col) for col in renew_forecast_df.columns]
+    # Convert time to local
+    df.index = df.index.tz_convert('America/Los_Angeles')
 
+    return df
 
-# Adding Weather Data
 
-weather_df = pd.read_csv("./Raw_Data/Weather_Data/Weather_Data.csv", index_col=0)
-weather_df.index = pd.to_datetime(weather_df.index)
+#### Data Validation ####
 
-# Create Hourly DataFrame
+# Checks on the merged hourly data
+HOURLY_RULES = [
+    # LMP should be roughly equivalent to the sum of all other lmp components at a given time
+    component_sum_rule('RT_LMP', ['RT_MCC', 'RT_MCE', 'RT_MCL', 'RT_MGHG']),
+    component_sum_rule('DA_LMP', ['DA_MCC', 'DA_MCE', 'DA_MCL', 'DA_MGHG']),
+    coverage_rule('H'),
+    range_rule('RT_LMP', -2000, 2000),
+    range_rule('DA_LMP', -2000, 2000),
+    range_rule('Load', 0),
+    range_rule('Generation', 0),
+    # Temperature is in Fahrenheit
+    range_rule('temperature_2m', -20, 130)]
+
+
+def validate_data(df, start=None, end=None, report_path=None):
+    """
+    Checks the raw datasets between start and end (UTC) and the merged hourly data df.
+
+    Only the raw rows the feature table is built from (the node NODE, CAISO totals and the
+    renewable labels used) are checked, one month at a time. Prints the rules with violations
+    and, if report_path is given, writes one row per rule and stage there as a csv.
+    """
+    # Same filters as the load_* stages
+    raw_filters = {'PRC_INTVL_LMP': {'NODE': [NODE]},
+                   'PRC_LMP': {'NODE': [NODE]},
+                   'ENE_SLRS': {'TAC_ZONE_NAME': ['Caiso_Totals']},
+                   'SLD_REN_FCST': {'LABEL': ['Renewable Forecast Day Ahead', 'Renewable Forecast Actual Generation']}}
 
-df_list = [hourly_rt_df, da_df, hourly_load_df, renew_forecast_df, weather_df]
-df = reduce(lambda left, right: pd.merge(left, right, 
-                                           left_index=True, 
-                                           right_index=True), df_list)
+    reports = [validate_raw(dataset_name, start, end, where=raw_filters.get(dataset_name)).assign(stage=dataset_name)
+               for dataset_name in RAW_INTERVALS]
+    reports.append(validate(df, HOURLY_RULES).assign(stage='hourly'))
 
+    report = pd.concat(reports, ignore_index=True)
+    report = report[['stage'] + [col for col in report.columns if col != 'stage']]
 
-# Convert time to local
-df.index = df.index.to_series().apply(utc_to_local)
+    failed = report[report['violations'] > 0]
+    if len(failed):
+        print("Data validation found violations:")
+        print(failed[['stage', 'rule', 'violations']].to_string(index=False))
+    if report_path is not None:
+        report.to_csv(report_path, index=False)
+
+    return report
 
 
 
 #### Feature Engineering ####
 
-# LMP Spike Indicators
-df['RTLMP_spike_50_binary'] = df['RT_LMP'].apply(lambda x: 1 if x >= 50 else 0)
-df['RTLMP_spike_75_binary'] = df['RT_LMP'].apply(lambda x: 1 if x >= 75 else 0)
-df['RTLMP_spike_100_binary'] = df['RT_LMP'].apply(lambda x: 1 if x >= 100 else 0)
-df['RTLMP_spike_150_binary'] = df['RT_LMP'].apply(lambda x: 1 if x >= 150 else 0)
+## Lagged variables for forecast error, import, export and generation
 
-# Create a variable for weekends
-df['friday'] = np.where(df.index.weekday==4, 1, 0)
-df['weekend']  = np.where(df.index.weekday>4, 1, 0)
-df['hour'] = df.index.hour
+lag_var_list = ['RT_LMP', 'DA_LMP', 'renew_forecast_error', 'Export', 'Generation', 'Import']
 
+LAG_SHIFTS = {}
+for var in lag_var_list:
+    for lag_hrs in [-2, -4, -12, -20, -22, -23]:
+        LAG_SHIFTS["lagged_" + str(-lag_hrs)+"hr_"+var] = (var, lag_hrs)
 
-# Create a variable for hour types
-df['on_peak_hour'] = np.where(((df.hour>=16) & (df.hour<=21)), 1, 0)
+# Lagged variables for temperature
 
-# Create a variable for month
-df['month'] = df.index.month
+for lag_hrs in [-2, -4, -12, -22, -23]:
+    LAG_SHIFTS["lagged_" + str(-lag_hrs)+"hr_temp"] = ('temperature_2m', lag_hrs)
+
+# Future variables as target variables
+TARGET_SHIFTS = {'DA_LMP_in_12_hrs': ('DA_LMP', 12),
+                 'DA_LMP_in_2_hrs': ('DA_LMP', 2),
+                 'RT_LMP_in_12_hrs': ('RT_LMP', 12),
+                 'RT_LMP_in_2_hrs': ('RT_LMP', 2),
+                 # Target Hour
+                 'target_hour': ('hour', 2),
+                 # Target Friday and Weekend Indicators
+                 'target_friday': ('friday', 2),
+                 'target_weekend': ('weekend', 2),
+                 # Target Month
+                 'target_month': ('month', 2),
+                 # Create encoded (cyclical) features for month and hour variables
+                 'target_sin_month': ('sin_month', 2),
+                 'target_cos_month': ('cos_month', 2),
+                 'target_sin_hour': ('sin_hour', 2),
+                 'target_cos_hour': ('cos_hour', 2)}
+
+# RT_LMP levels ($/MWh) flagged as price spikes
+SPIKE_THRESHOLDS = [50, 75, 100, 150]
+
+# Rolling mean, std, min, max and EWMA over ROLLING_WINDOWS for the lagged variables, plus
+# counts of spike hours for the prices
+ROLLING_SPIKE_VARS = ['RT_LMP', 'DA_LMP']
+
+# Hours of history a row's lag and rolling features need and hours of future its targets need
+MAX_LAG_HOURS = max(-min(shift_hours for _, shift_hours in LAG_SHIFTS.values()), max(ROLLING_WINDOWS) - 1)
+MAX_LEAD_HOURS = max(shift_hours for _, shift_hours in TARGET_SHIFTS.values())
+
+
+def format_column_names(columns):
+    """Replaces spaces and '-' in column names with '_'"""
+    return ['_'.join(colname.split()).replace('-', '_') for colname in columns]
+
+
+def add_renewable_totals(df):
+    """Adds CAISO-wide wind / solar totals and their forecast errors to df in place and returns it"""
+
+    # Sum wind and solar generation across zones to get "Total" that is more indicative of overall CAISO generation
+    df['Total_Solar_Actual'] = df['NP15_Solar_Renewable Forecast Actual Generation'] + df['SP15_Solar_Renewable Forecast Actual Generation'] + df['ZP26_Solar_Renewable Forecast Actual Generation']
+    df['Total_Solar_Forecast'] = df['NP15_Solar_Renewable Forecast Day Ahead'] + df['SP15_Solar_Renewable Forecast Day Ahead'] + df['ZP26_Solar_Renewable Forecast Day Ahead']
+
+    df['Total_Wind_Actual'] = df['NP15_Wind_Renewable Forecast Actual Generation'] + df['SP15_Wind_Renewable Forecast Actual Generation']
+    df['Total_Wind_Forecast'] = df['NP15_Wind_Renewable Forecast Day Ahead'] + df['SP15_Wind_Renewable Forecast Day Ahead']
+
+    # Calculate sum of wind and solar actuals / forecasts
+    df['Total_Wind_Solar_Actual'] = df['Total_Solar_Actual'] + df['Total_Wind_Actual']
+    df['Total_Wind_Solar_Forecast'] = df['Total_Solar_Forecast'] + df['Total_Wind_Forecast']
+
+    # Calculate Wind / Solar Forecast Error
+    df['renew_forecast_error'] = df['Total_Wind_Solar_Actual'] - df['Total_Wind_Solar_Forecast']
+    df['solar_forecast_error'] = df['Total_Solar_Actual'] - df['Total_Solar_Forecast']
+    df['wind_forecast_error'] = df['Total_Wind_Actual'] - df['Total_Wind_Forecast']
 
-# Sum wind and solar generation across zones to get "Total" that is more indicative of overall CAISO generation
-df['Total_Solar_Actual'] = df['NP15_Solar_Renewable Forecast Actual Generation'] + df['SP15_Solar_Renewable Forecast Actual Generation'] + df['ZP26_Solar_Renewable Forecast Actual Generation']
-df['Total_Solar_Forecast'] = df['NP15_Solar_Renewable Forecast Day Ahead'] + df['SP15_Solar_Renewable Forecast Day Ahead'] + df['ZP26_Solar_Renewable Forecast Day Ahead']
+    return df
 
-df['Total_Wind_Actual'] = df['NP15_Wind_Renewable Forecast Actual Generation'] + df['SP15_Wind_Renewable Forecast Actual Generation']
-df['Total_Wind_Forecast'] = df['NP15_Wind_Renewable Forecast Day Ahead'] + df['SP15_Wind_Renewable Forecast Day Ahead']
 
-# Calculate sum of wind and solar actuals / forecasts
-df['Total_Wind_Solar_Actual'] = df['Total_Solar_Actual'] + df['Total_Wind_Actual']
-df['Total_Wind_Solar_Forecast'] = df['Total_Solar_Forecast'] + df['Total_Wind_Forecast']
+def add_features(df):
+    """Adds the calendar, renewable, lagged, rolling and target features to the merged hourly DataFrame"""
 
-# Calculate Wind / Solar Forecast Error
-df['renew_forecast_error'] = df['Total_Wind_Solar_Actual'] - df['Total_Wind_Solar_Forecast']
-df['solar_forecast_error'] = df['Total_Solar_Actual'] - df['Total_Solar_Forecast']
-df['wind_forecast_error'] = df['Total_Wind_Actual'] - df['Total_Wind_Forecast']
+    # LMP Spike Indicators
+    spike_cols = ['RTLMP_spike_' + str(threshold) + '_binary' for threshold in SPIKE_THRESHOLDS]
+    spike_df = pd.DataFrame(spike_flags(df['RT_LMP'], SPIKE_THRESHOLDS), index=df.index, columns=spike_cols)
 
+    # Create variables for fridays, weekends, hour, on-peak hours and month, plus their cyclical encodings
+    calendar_df = calendar_features(df.index)
+    cyclical_cols = ['sin_month', 'cos_month', 'sin_hour', 'cos_hour']
 
+    df = pd.concat([df, spike_df, calendar_df.drop(columns=cyclical_cols)], axis=1)
 
-# Write function to create lagged and future variables
+    # Total wind and solar generation and forecast errors
+    df = add_renewable_totals(df)
 
-def create_shifted_series(df, col_name, shift_hours):
-    """Create a column of col_name that is shifted 'shift_hours' in the future"""
-    shifted_series = pd.Series(index=df.index)
 
-    for idx, row in df.iterrows():
-        shifted_time = idx + pd.Timedelta(hours=shift_hours)
-        
-        if shifted_time in df.index:
-            shifted_value = df.loc[shifted_time, col_name]
-        else:
-            shifted_value = None
-        
-        shifted_series[idx] = shifted_value
+    # Create lagged variables
+    df = pd.concat([df, create_shifted_columns(df, LAG_SHIFTS)], axis=1)
 
-    return shifted_series
+    # Create rolling statistics
+    df = pd.concat([df, rolling_features(df, lag_var_list, spike_columns=ROLLING_SPIKE_VARS,
+                                         spike_thresholds=SPIKE_THRESHOLDS)], axis=1)
 
 
-## Use function to create lagged variables for forecast error, import, export and generation
+    # Add encoded (cyclical) features for month and hour variables
+    df = pd.concat([df, calendar_df[cyclical_cols]], axis=1)
 
-lag_var_list = ['RT_LMP', 'DA_LMP', 'renew_forecast_error', 'Export', 'Generation', 'Import']
+    # Create future variables as target variables
+    df = pd.concat([df, create_shifted_columns(df, TARGET_SHIFTS)], axis=1)
+
+    # Format data timezone index and column names
+    df.index = pd.to_datetime(df.index, format='%Y-%m-%d', utc=True)
+    df.index = df.index.tz_convert("America/Los_Angeles")
+    df.columns = format_column_names(df.columns)
+
+    return df
+
+
+def build_feature_table(start=None, end=None, gap_report_path=None, validation_report_path=None):
+    """Builds the hourly feature table from the raw store between start and end (UTC) and validates its inputs"""
+    df = merge_sources(load_sources(start, end), gap_report_path)
+    validate_data(df, start, end, validation_report_path)
+    return add_features(df)
+
+
+#### Multi-node Panel ####
+
+# Node-level prices are stored for every node downloaded. The system-wide load, renewable and
+# weather data are shared by all nodes
+
+@cached_stage('PRC_INTVL_LMP')
+def load_panel_rt(start=None, end=None, nodes=None):
+    """Returns hourly averages of the 5-minute real-time prices by (node, hour), for nodes (all stored nodes if None)"""
+    panel_rt_df = hourly_means('PRC_INTVL_LMP', label_col='LMP_TYPE', value_col='VALUE', start=start, end=end,
+                               where={'NODE': nodes} if nodes else None, by=['NODE'])
+
+    panel_rt_df.columns = ["RT_" + col for col in panel_rt_df.columns]
+
+    return panel_rt_df.swaplevel().sort_index()
+
+
+@cached_stage('PRC_LMP')
+def load_panel_da(start=None, end=None, nodes=None):
+    """Returns hourly day-ahead prices by (node, hour), for nodes (all stored nodes if None)"""
+    da_df = read_query('PRC_LMP', columns=['INTERVALSTARTTIME_GMT', 'NODE', 'LMP_TYPE', 'MW'], start=start, end=end,
+                       where={'NODE': nodes} if nodes else None)
+
+    da_df = pivot_long_to_wide(da_df, index=['NODE', 'INTERVALSTARTTIME_GMT'], columns='LMP_TYPE', values='MW')
+
+    da_df.columns = ["DA_" + col for col in da_df.columns]
+
+    return da_df
+
+
+def merge_panel_sources(rt_panel, da_panel, system_df):
+    """
+    Inner joins the node-level prices with each other and with the system-wide hourly data.
+
+    Parameters
+    ----------
+    rt_panel, da_panel : DataFrame
+        Node-level prices indexed by (NODE, UTC hour).
+    system_df : DataFrame
+        System-wide hourly data (load, renewables, weather) from merge_sources.
+
+    Returns
+    -------
+    panel_df : DataFrame
+        Node prices followed by the system columns, indexed by (NODE, local hour) and sorted.
+        Each system row is gathered once per node with a single index lookup.
+    """
+    panel_df = rt_panel.join(da_panel, how='inner')
+
+    positions = system_df.index.get_indexer(panel_df.index.get_level_values(1))
+    panel_df = panel_df[positions >= 0]
+    positions = positions[positions >= 0]
+
+    system_block = pd.DataFrame({col: system_df[col].to_numpy()[positions] for col in system_df.columns}, index=panel_df.index)
+    panel_df = pd.concat([panel_df, system_block], axis=1)
+
+    # Convert time to local
+    hours = panel_df.index.levels[1].tz_convert('America/Los_Angeles')
+    panel_df.index = panel_df.index.set_levels(hours, level=1)
+
+    return panel_df.sort_index()
 
+
+def add_panel_features(panel_df):
+    """
+    Adds the features of add_features to every node of a (node, hour) panel at once.
+
+    Spike flags and calendar features are row-wise, and the renewable totals are system-wide,
+    so only the lags, rolling statistics and targets need the node grouping, which
+    create_panel_shifted_columns and rolling_features handle without looping over nodes.
+    """
+    hours = panel_df.index.get_level_values(1)
+
+    spike_cols = ['RTLMP_spike_' + str(threshold) + '_binary' for threshold in SPIKE_THRESHOLDS]
+    spike_df = pd.DataFrame(spike_flags(panel_df['RT_LMP'], SPIKE_THRESHOLDS), index=panel_df.index, columns=spike_cols)
+
+    calendar_df = calendar_features(hours)
+    calendar_df.index = panel_df.index
+    cyclical_cols = ['sin_month', 'cos_month', 'sin_hour', 'cos_hour']
+
+    df = pd.concat([panel_df, spike_df, calendar_df.drop(columns=cyclical_cols)], axis=1)
+
+    df = pd.concat([df, create_panel_shifted_columns(df, LAG_SHIFTS)], axis=1)
+    df = pd.concat([df, rolling_features(df, lag_var_list, spike_columns=ROLLING_SPIKE_VARS,
+                                         spike_thresholds=SPIKE_THRESHOLDS)], axis=1)
+    df = pd.concat([df, calendar_df[cyclical_cols]], axis=1)
+    df = pd.concat([df, create_panel_shifted_columns(df, TARGET_SHIFTS)], axis=1)
+
+    df.columns = format_column_names(df.columns)
+
+    return df
+
+
+def build_panel_feature_table(start=None, end=None, nodes=None):
+    """Builds the (node, hour) feature table for nodes (all stored nodes if None) between start and end (UTC)"""
+    system_df = merge_sources({'hourly_load': load_hourly_load(start, end),
+                               'renew_forecast': load_renew_forecast(start, end),
+                               'weather': load_weather(start, end)})
+    system_df.index = system_df.index.tz_convert('UTC')
+
+    # Totals are system-wide, so compute them once per hour rather than once per node
+    system_df = add_renewable_totals(system_df)
+
+    panel_df = merge_panel_sources(load_panel_rt(start, end, nodes), load_panel_da(start, end, nodes), system_df)
+    return add_panel_features(panel_df)
+
+
+#### 5-Minute Interval Resolution ####
+
+# The interval table keeps the 5-minute RT prices and CAISO load instead of hourly means. It is
+# indexed by the integer epoch interval (seconds since the epoch // INTERVAL_SECONDS) and stored
+# as float32 Parquet. Lags, windows and targets are in intervals
+
+INTERVAL_SECONDS = 300
+INTERVALS_PER_HOUR = 3600 // INTERVAL_SECONDS
+INTERVAL_COL = 'INTERVAL'
+
+# Lags of the hourly table (in hours) plus the last few intervals of the 5-minute variables
+INTERVAL_LAG_SHIFTS = {}
 for var in lag_var_list:
     for lag_hrs in [-2, -4, -12, -20, -22, -23]:
-        col_name = "lagged_" + str(-lag_hrs)+"hr_"+var
-        df[col_name] = create_shifted_series(df=df, col_name=var, shift_hours=lag_hrs)
-        
+        INTERVAL_LAG_SHIFTS["lagged_" + str(-lag_hrs)+"hr_"+var] = (var, lag_hrs * INTERVALS_PER_HOUR)
 
-# Use function to create lagged variables for temperature
+for var in ['RT_LMP', 'Export', 'Generation', 'Import']:
+    for lag_intervals in [-1, -2, -3, -6]:
+        INTERVAL_LAG_SHIFTS["lagged_" + str(-lag_intervals)+"int_"+var] = (var, lag_intervals)
 
 for lag_hrs in [-2, -4, -12, -22, -23]:
-    col_name = "lagged_" + str(-lag_hrs)+"hr_temp"
-    df[col_name] = create_shifted_series(df=df, col_name='temperature_2m', shift_hours=lag_hrs)
-        
-
-# Create encoded (cyclical) features for month and hour variables        
-df['sin_month'] = np.sin(2 * np.pi * df['month']/12.0)
-df['cos_month'] = np.cos(2 * np.pi * df['month']/12.0)
-df['sin_hour'] = np.sin(2 * np.pi * df['hour']/24.0)
-df['cos_hour'] = np.cos(2 * np.pi * df['hour']/24.0)
-
-# Create future variables as target variables
-df['DA_LMP_in_12_hrs'] = create_shifted_series(df=df, col_name='DA_LMP', shift_hours=12)
-df['DA_LMP_in_2_hrs'] = create_shifted_series(df=df, col_name='DA_LMP', shift_hours=2)
-
-df['RT_LMP_in_12_hrs'] = create_shifted_series(df=df, col_name='RT_LMP', shift_hours=12)
-df['RT_LMP_in_2_hrs'] = create_shifted_series(df=df, col_name='RT_LMP', shift_hours=2)
-
-# Target Hour
-df['target_hour'] = create_shifted_series(df=df, col_name='hour', shift_hours=2)
-
-# Target Friday and Weekend Indicators
-df['target_friday'] = create_shifted_series(df=df, col_name='friday', shift_hours=2)
-df['target_weekend'] = create_shifted_series(df=df, col_name='weekend', shift_hours=2)
-
-# Target Month
-df['target_month'] = create_shifted_series(df=df, col_name='month', shift_hours=2)
-
-# Create encoded (cyclical) features for month and hour variables
-df['target_sin_month'] = create_shifted_series(df=df, col_name='sin_month', shift_hours=2)
-df['target_cos_month'] = create_shifted_series(df=df, col_name='cos_month', shift_hours=2)
-df['target_sin_hour'] = create_shifted_series(df=df, col_name='sin_hour', shift_hours=2)
-df['target_cos_hour'] = create_shifted_series(df=df, col_name='cos_hour', shift_hours=2)
-        
-# Format data timezone index and column names
-df.index = pd.to_datetime(df.index, format='%Y-%m-%d', utc=True)
-df.index = df.index.tz_convert("America/Los_Angeles")
-df.columns = ['_'.join(colname.split()) for colname in df.columns]
-df.columns = [colname.replace('-','_') for colname in df.columns]
-
-
-df.to_csv('./Cleaned_Data/LMP_and_feature_data.csv')
+    INTERVAL_LAG_SHIFTS["lagged_" + str(-lag_hrs)+"hr_temp"] = ('temperature_2m', lag_hrs * INTERVALS_PER_HOUR)
+
+INTERVAL_TARGET_SHIFTS = {'RT_LMP_in_1_int': ('RT_LMP', 1),
+                          'RT_LMP_in_3_int': ('RT_LMP', 3),
+                          'RT_LMP_in_12_int': ('RT_LMP', 12),
+                          'RT_LMP_in_2_hrs': ('RT_LMP', 2 * INTERVALS_PER_HOUR),
+                          'DA_LMP_in_2_hrs': ('DA_LMP', 2 * INTERVALS_PER_HOUR)}
+
+# Rolling windows of 1, 6 and 24 hours, in intervals
+INTERVAL_ROLLING_WINDOWS = [12, 72, 288]
+
+
+def to_intervals(index):
+    """Returns the integer epoch interval of each timestamp in a tz-aware DatetimeIndex"""
+    return pd.Index(index.asi8 // (INTERVAL_SECONDS * 10**9), name=INTERVAL_COL)
+
+
+def interval_timestamps(intervals, tz='America/Los_Angeles'):
+    """Returns the start time of each integer epoch interval as a DatetimeIndex in tz"""
+    return pd.to_datetime(np.asarray(intervals, dtype='int64') * INTERVAL_SECONDS, unit='s', utc=True).tz_convert(tz)
+
+
+@cached_stage('PRC_INTVL_LMP')
+def load_interval_rt(start=None, end=None):
+    """Returns the 5-minute real-time prices between start and end (UTC), indexed by epoch interval"""
+    rt_df = read_query('PRC_INTVL_LMP', columns=['INTERVALSTARTTIME_GMT', 'LMP_TYPE', 'VALUE'], start=start, end=end,
+                       where={'NODE': [NODE]})
+
+    rt_df = pivot_long_to_wide(rt_df, index='INTERVALSTARTTIME_GMT', columns='LMP_TYPE', values='VALUE')
+    rt_df.index = to_intervals(rt_df.index)
+
+    rt_df.columns = ["RT_" + col for col in rt_df.columns]
+
+    return rt_df
+
+
+@cached_stage('ENE_SLRS')
+def load_interval_load(start=None, end=None):
+    """Returns CAISO-wide 5-minute export, generation, import and load between start and end (UTC), indexed by epoch interval"""
+    load_df = read_query('ENE_SLRS', columns=['INTERVALSTARTTIME_GMT', 'SCHEDULE', 'MW'], start=start, end=end,
+                         where={'TAC_ZONE_NAME': ['Caiso_Totals']})
+
+    load_df = pivot_long_to_wide(load_df, index='INTERVALSTARTTIME_GMT', columns='SCHEDULE', values='MW')
+    load_df.index = to_intervals(load_df.index)
+
+    return load_df
+
+
+def merge_interval_sources(interval_sources, hourly_df):
+    """
+    Inner joins the 5-minute sources and gives each interval the values of its hour in hourly_df.
+
+    Parameters
+    ----------
+    interval_sources : list of DataFrame
+        5-minute data indexed by epoch interval.
+    hourly_df : DataFrame
+        Hourly data (e.g. day-ahead prices, renewables, weather) indexed by UTC hour.
+
+    Returns
+    -------
+    df : DataFrame
+        Interval columns followed by hourly columns, for intervals present in every source.
+    """
+    df = interval_sources[0]
+    for source in interval_sources[1:]:
+        df = df.join(source, how='inner')
+
+    interval_hours = interval_timestamps(df.index, tz='UTC').floor('H')
+    positions = hourly_df.index.get_indexer(interval_hours)
+    df = df[positions >= 0]
+    positions = positions[positions >= 0]
+
+    hourly_block = pd.DataFrame({col: hourly_df[col].to_numpy()[positions] for col in hourly_df.columns}, index=df.index)
+    return pd.concat([df, hourly_block], axis=1)
+
+
+def add_interval_features(df):
+    """Adds the calendar, lagged, rolling and target features of add_features to the 5-minute table, in intervals"""
+    spike_cols = ['RTLMP_spike_' + str(threshold) + '_binary' for threshold in SPIKE_THRESHOLDS]
+    spike_df = pd.DataFrame(spike_flags(df['RT_LMP'], SPIKE_THRESHOLDS), index=df.index, columns=spike_cols)
+
+    calendar_df = calendar_features(interval_timestamps(df.index))
+    calendar_df.index = df.index
+    calendar_df.insert(3, 'interval_of_hour', (df.index.to_numpy() % INTERVALS_PER_HOUR).astype('int8'))
+
+    df = pd.concat([df, spike_df, calendar_df], axis=1)
+
+    df = pd.concat([df, create_shifted_columns(df, INTERVAL_LAG_SHIFTS)], axis=1)
+    df = pd.concat([df, rolling_features(df, lag_var_list, windows=INTERVAL_ROLLING_WINDOWS,
+                                         spike_columns=ROLLING_SPIKE_VARS, spike_thresholds=SPIKE_THRESHOLDS, unit='int')], axis=1)
+    df = pd.concat([df, create_shifted_columns(df, INTERVAL_TARGET_SHIFTS)], axis=1)
+
+    df.columns = format_column_names(df.columns)
+
+    # Keep the table compact: float32 values next to the int8 calendar columns
+    float_cols = df.select_dtypes('float64').columns
+    df[float_cols] = df[float_cols].astype('float32')
+
+    return df
+
+
+def build_interval_feature_table(start=None, end=None):
+    """Builds the 5-minute feature table from the raw store between start and end (UTC)"""
+    hourly_df = merge_sources({'da': load_da(start, end),
+                               'renew_forecast': load_renew_forecast(start, end),
+                               'weather': load_weather(start, end)})
+    hourly_df.index = hourly_df.index.tz_convert('UTC')
+    hourly_df = add_renewable_totals(hourly_df)
+
+    df = merge_interval_sources([load_interval_rt(start, end), load_interval_load(start, end)], hourly_df)
+    return add_interval_features(df)
+
+
+#### Incremental Updates ####
+
+def read_csv_tail(path, n_rows):
+    """
+    Reads the last n_rows of a csv without parsing the rest of the file.
+
+    Returns
+    -------
+    offsets : list of int
+        Byte offset in the file where each of the returned rows starts.
+    tail_df : DataFrame
+        The last n_rows rows, parsed with the first column as the index.
+    """
+    with open(path, 'rb') as f:
+        header = f.readline()
+        header_end = f.tell()
+        file_end = f.seek(0, os.SEEK_END)
+
+        # Read backwards in blocks until enough complete lines have been seen
+        pos = file_end
+        data = b''
+        while pos > header_end and data.count(b'\n') <= n_rows:
+            read_size = min(1 << 16, pos - header_end)
+            pos -= read_size
+            f.seek(pos)
+            data = f.read(read_size) + data
+
+    lines = data.splitlines(keepends=True)
+    if pos > header_end:
+        lines = lines[1:]   # First line may have been cut by the block boundary
+    lines = lines[-n_rows:]
+
+    offsets = list(file_end - np.cumsum([len(line) for line in lines[::-1]])[::-1])
+    tail_df = pd.read_csv(BytesIO(header + b''.join(lines)), index_col=0)
+    tail_df.index = pd.to_datetime(tail_df.index, utc=True).tz_convert("America/Los_Angeles")
+
+    return offsets, tail_df
+
+
+def update_feature_table(path=FEATURE_TABLE_PATH):
+    """
+    Recomputes only the hours of the feature table at path that can have changed since it was written.
+
+    These are the hours after the last row plus the last MAX_LEAD_HOURS hours, whose future
+    (target) values were not yet known. Raw data is loaded from MAX_LAG_HOURS before that so lag
+    features match a full rebuild. The stale tail of the csv is truncated in place and the
+    recomputed rows are appended, so the cost does not grow with the age of the dataset.
+    """
+    offsets, tail_df = read_csv_tail(path, MAX_LEAD_HOURS + 1)
+
+    recompute_start = tail_df.index.max() - pd.Timedelta(hours=MAX_LEAD_HOURS)
+    load_start = recompute_start - pd.Timedelta(hours=MAX_LAG_HOURS)
+
+    new_df = build_feature_table(start=load_start, validation_report_path=VALIDATION_REPORT_PATH)
+    new_df = new_df[new_df.index >= recompute_start]
+
+    if set(new_df.columns) != set(tail_df.columns):
+        print("Feature columns changed since the table was written. Rebuilding it in full")
+        build_feature_table(gap_report_path=GAP_REPORT_PATH, validation_report_path=VALIDATION_REPORT_PATH).to_csv(path)
+        return
+
+    # Rows from recompute_start onwards are replaced by the recomputed rows
+    first_stale_row = int(np.searchsorted(tail_df.index, recompute_start))
+    truncate_at = offsets[first_stale_row] if first_stale_row < len(offsets) else os.path.getsize(path)
+
+    with open(path, 'r+b') as f:
+        f.truncate(truncate_at)
+
+    new_df[tail_df.columns].to_csv(path, mode='a', header=False)
+    print(f"Updated {len(new_df)} hours from {recompute_start} onwards")
+
+
+if __name__ == '__main__':
+    if '--interval' in sys.argv:
+        build_interval_feature_table().to_parquet(INTERVAL_TABLE_PATH)
+    elif '--incremental' in sys.argv and os.path.exists(FEATURE_TABLE_PATH):
+        update_feature_table(FEATURE_TABLE_PATH)
+    else:
+        build_feature_table(gap_report_path=GAP_REPORT_PATH,
+                            validation_report_path=VALIDATION_REPORT_PATH).to_csv(FEATURE_TABLE_PATH)
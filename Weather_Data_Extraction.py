@@ -14,8 +14,6 @@ from datetime import datetime, timedelta, timezone, date
 from functools import reduce
 import requests
 from io import StringIO 
-import os
-import shutil
 
 
 import openmeteo_requests
@@ -24,6 +22,9 @@ import requests_cache
 import pandas as pd
 from retry_requests import retry
 
+from oasis_schema import TIME_COL
+from raw_store import write_dataset
+
 # Setup the Open-Meteo API client with cache and retry on error
 cache_session = requests_cache.CachedSession('.cache', expire_after = -1)
 retry_session = retry(cache_session, retries = 5, backoff_factor = 0.2)
@@ -64,21 +65,9 @@ hourly_data["temperature_2m"] = hourly_temperature_2m
 hourly_dataframe = pd.DataFrame(data = hourly_data)
 
 
-# Code below created by author. Sets date as index, adds UTC timezone and exports data
-
-hourly_dataframe.set_index('date', inplace=True)
-hourly_dataframe.index = pd.to_datetime(hourly_dataframe.index).tz_localize('UTC')
-
-path = 'Raw_Data/Weather_Data'
-
-if not os.path.exists(path):
-    os.makedirs(path)
-else:
-    shutil.rmtree(path)           # Removes all the subdirectories
-    os.makedirs(path)
-    
-hourly_dataframe.to_csv('Raw_Data/Weather_Data/Weather_Data.csv')
-
-
+# Code below created by author. Adds UTC timezone and writes data to the month-partitioned raw store
 
+hourly_dataframe['date'] = hourly_dataframe['date'].dt.tz_localize('UTC')
+hourly_dataframe = hourly_dataframe.rename(columns={'date': TIME_COL})
 
+write_dataset('WEATHER', hourly_dataframe)
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+Walk-forward backtesting: steps through history by day or week, refitting the model incrementally on the
+data available at each step and scoring it on the following step
+
+"""
+import numbers
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn import metrics
+from sklearn.base import clone
+
+
+class ForestRefit:
+    """
+    Random forest that grows warm-started trees at each step instead of being refit from scratch.
+
+    Each update fits trees_per_step new trees on the training rows available at that step and
+    drops the oldest trees, so the forest keeps its size and leans towards recent data. An integer
+    random_state is advanced by one at each update: the forest seeds its new trees after skipping
+    one draw per existing tree, so a fixed seed would otherwise give every step the same tree seeds.
+
+    Parameters:
+        estimator (RandomForestRegressor): Unfitted forest with the chosen hyperparameters. Its n_estimators is the forest size.
+        trees_per_step (int): Trees added (and dropped) at each update.
+        recent_rows (int): If set, new trees are fit on only the last recent_rows training rows.
+    """
+
+    def __init__(self, estimator, trees_per_step=20, recent_rows=None):
+        self.estimator = estimator
+        self.trees_per_step = trees_per_step
+        self.recent_rows = recent_rows
+        self.model = None
+        self.steps = 0
+
+    def fit(self, X, y, rows):
+        self.model = clone(self.estimator).set_params(warm_start=True).fit(X[rows], y[rows])
+        self.steps = 0
+
+    def update(self, X, y, rows):
+        rows = rows if self.recent_rows is None else rows[-self.recent_rows:]
+        forest_size = self.estimator.get_params()['n_estimators']
+        seed = self.estimator.get_params()['random_state']
+
+        self.steps += 1
+        if isinstance(seed, numbers.Integral):
+            self.model.set_params(random_state=seed + self.steps)
+        self.model.set_params(n_estimators=len(self.model.estimators_) + self.trees_per_step)
+        self.model.fit(X[rows], y[rows])
+
+        # Keep the newest trees
+        self.model.estimators_ = self.model.estimators_[-forest_size:]
+        self.model.n_estimators = len(self.model.estimators_)
+
+    def predict(self, X, rows):
+        return self.model.predict(X[rows])
+
+
+class BoostingRefit:
+    """
+    Gradient boosted trees (XGBRegressor) continued from the previous booster at each step.
+
+    Each update adds rounds_per_step boosting rounds fit to the residuals of the last recent_rows
+    training rows, passing the previous booster as xgb_model. The booster grows at every update,
+    so pair it with refit_every in walk_forward for long backtests.
+
+    Parameters:
+        estimator (XGBRegressor): Unfitted model with the chosen hyperparameters.
+        rounds_per_step (int): Boosting rounds added at each update.
+        recent_rows (int): Training rows (most recent first) the added rounds are fit on.
+    """
+
+    def __init__(self, estimator, rounds_per_step=20, recent_rows=24 * 28):
+        self.estimator = estimator
+        self.rounds_per_step = rounds_per_step
+        self.recent_rows = recent_rows
+        self.model = None
+
+    def fit(self, X, y, rows):
+        self.model = clone(self.estimator).fit(X[rows], y[rows])
+
+    def update(self, X, y, rows):
+        rows = rows[-self.recent_rows:]
+        self.model = clone(self.estimator).set_params(n_estimators=self.rounds_per_step) \
+            .fit(X[rows], y[rows], xgb_model=self.model.get_booster())
+
+    def predict(self, X, rows):
+        return self.model.predict(X[rows])
+
+
+class KerasRefit:
+    """
+    Keras model trained once, then fine-tuned on the most recent rows at each step from its current weights.
+
+    Parameters:
+        build_model (function): Returns a new compiled Keras model.
+        epochs (int): Epochs of the initial fit (and of full refits).
+        fine_tune_epochs (int): Epochs of each update.
+        recent_rows (int): Training rows (most recent first) each update is fit on.
+        batch_size (int): Samples per gradient step.
+    """
+
+    def __init__(self, build_model, epochs=20, fine_tune_epochs=2, recent_rows=24 * 28, batch_size=32):
+        self.build_model = build_model
+        self.epochs = epochs
+        self.fine_tune_epochs = fine_tune_epochs
+        self.recent_rows = recent_rows
+        self.batch_size = batch_size
+        self.model = None
+
+    def fit(self, X, y, rows):
+        self.model = self.build_model()
+        self.model.fit(X[rows], y[rows], epochs=self.epochs, batch_size=self.batch_size, verbose=0)
+
+    def update(self, X, y, rows):
+        rows = rows[-self.recent_rows:]
+        self.model.fit(X[rows], y[rows], epochs=self.fine_tune_epochs, batch_size=self.batch_size, verbose=0)
+
+    def predict(self, X, rows):
+        return self.model.predict(X[rows], batch_size=1024, verbose=0).reshape(-1)
+
+
+def walk_forward(refitter, X, y, target_times, start, step='7D', horizon=pd.Timedelta(hours=2), valid=None,
+                 refit_every=None, inverse_transform=None):
+    """
+    Backtests a model the way it runs in production: refit on what is known, forecast the next step, repeat.
+
+    At each step boundary b the model is updated with every sample whose target time is before b,
+    then scored on the samples whose forecast is issued during the step, i.e. whose target time
+    is in [b + horizon, next boundary + horizon). Each sample is scored exactly once, by the
+    model available when its forecast was made.
+
+    Parameters
+    ----------
+    refitter : ForestRefit, BoostingRefit or KerasRefit
+        Model wrapper with fit(X, y, rows), update(X, y, rows) and predict(X, rows).
+    X : array-like of shape (n_samples, ...)
+        Inputs in time order, e.g. a feature table as an array or RNN windows.
+    y : ndarray of shape (n_samples,)
+        Target values.
+    target_times : DatetimeIndex of length n_samples
+        Time of each sample's target, in increasing order.
+    start : str or Timestamp
+        First step boundary. Samples before it only train the first model.
+    step : str
+        Step length, e.g. '1D' or '7D'.
+    horizon : Timedelta
+        Time between a forecast being issued and its target hour.
+    valid : ndarray of bool
+        Samples to use (e.g. the valid windows of sliding_windows). Defaults to all.
+    refit_every : int
+        If set, the model is refit from scratch every refit_every steps instead of updated.
+    inverse_transform : function
+        Applied to targets and predictions before scoring, e.g. scaler_y.inverse_transform.
+
+    Returns
+    -------
+    steps : DataFrame
+        One row per step with its start, training and test sample counts, RMSE, MAE, MAPE and
+        fit and predict seconds.
+    predictions : DataFrame
+        y_true, y_pred and step for every scored sample, indexed by target time.
+    """
+    samples = np.arange(len(y)) if valid is None else np.flatnonzero(valid)
+    times = pd.DatetimeIndex(target_times)[samples]
+    start = pd.Timestamp(start)
+    if start.tzinfo is None and times.tz is not None:
+        start = start.tz_localize(times.tz)
+
+    boundaries = pd.date_range(start, times[-1] - horizon, freq=step).append(
+        pd.DatetimeIndex([times[-1] - horizon + pd.Timedelta(1, 'ns')]))
+    train_ends = times.searchsorted(boundaries)
+    test_bounds = times.searchsorted(boundaries + horizon)
+
+    records, predictions = [], []
+    for i in range(len(boundaries) - 1):
+        train_rows = samples[:train_ends[i]]
+        test_rows = samples[test_bounds[i]:test_bounds[i + 1]]
+        if len(test_rows) == 0:
+            continue
+
+        fit_start = time.perf_counter()
+        if refitter.model is None or (refit_every and i % refit_every == 0):
+            refitter.fit(X, y, train_rows)
+        else:
+            refitter.update(X, y, train_rows)
+        fit_seconds = time.perf_counter() - fit_start
+
+        predict_start = time.perf_counter()
+        y_pred = np.asarray(refitter.predict(X, test_rows)).reshape(-1)
+        predict_seconds = time.perf_counter() - predict_start
+
+        y_true = np.asarray(y[test_rows]).reshape(-1)
+        if inverse_transform is not None:
+            y_true = inverse_transform(y_true.reshape(-1, 1)).reshape(-1)
+            y_pred = inverse_transform(y_pred.reshape(-1, 1)).reshape(-1)
+
+        records.append({'step_start': boundaries[i],
+                        'train_samples': len(train_rows),
+                        'test_samples': len(test_rows),
+                        'rmse': np.sqrt(metrics.mean_squared_error(y_true, y_pred)),
+                        'mae': metrics.mean_absolute_error(y_true, y_pred),
+                        'mape': metrics.mean_absolute_percentage_error(y_true, y_pred),
+                        'fit_seconds': fit_seconds,
+                        'predict_seconds': predict_seconds})
+        predictions.append(pd.DataFrame({'y_true': y_true, 'y_pred': y_pred, 'step': i},
+                                        index=pd.DatetimeIndex(target_times)[test_rows]))
+
+    steps = pd.DataFrame(records)
+    predictions = pd.concat(predictions) if predictions else pd.DataFrame(columns=['y_true', 'y_pred', 'step'])
+
+    if len(steps):
+        print(f"walk_forward: {len(steps)} steps in {steps['fit_seconds'].sum() + steps['predict_seconds'].sum():.1f}s, "
+              f"RMSE {np.sqrt(metrics.mean_squared_error(predictions['y_true'], predictions['y_pred'])):.2f}")
+
+    return steps, predictions
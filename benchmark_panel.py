@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the multi-node panel features in DataCleaning.py at 10, 100 and 1000 nodes on synthetic data
+
+Run with an optional number of days, e.g. python benchmark_panel.py 30
+
+"""
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from DataCleaning import add_renewable_totals, merge_panel_sources, add_panel_features
+from oasis_schema import TIME_COL
+
+
+NODE_COUNTS = [10, 100, 1000]
+
+LMP_TYPES = ['LMP', 'MCC', 'MCE', 'MCL', 'MGHG']
+RENEWABLE_SERIES = [('NP15', 'Solar'), ('NP15', 'Wind'), ('SP15', 'Solar'), ('SP15', 'Wind'), ('ZP26', 'Solar')]
+
+
+def synthetic_system(hours, rng):
+    """Returns system-wide hourly data with the columns merge_sources produces"""
+    columns = {schedule: rng.normal(1000, 100, len(hours)) for schedule in ['Export', 'Generation', 'Import', 'Load']}
+    for hub, renewable_type in RENEWABLE_SERIES:
+        for label in ['Renewable Forecast Actual Generation', 'Renewable Forecast Day Ahead']:
+            columns[f'{hub}_{renewable_type}_{label}'] = rng.normal(500, 50, len(hours))
+    columns['temperature_2m'] = rng.normal(60, 10, len(hours))
+
+    return pd.DataFrame(columns, index=hours).astype('float32')
+
+
+def synthetic_prices(hours, nodes, prefix, rng):
+    """Returns node-level prices indexed by (NODE, hour) with one column per LMP type"""
+    index = pd.MultiIndex.from_product([nodes, hours], names=['NODE', TIME_COL])
+    values = rng.normal(40, 20, (len(index), len(LMP_TYPES))).astype('float32')
+    return pd.DataFrame(values, index=index, columns=[prefix + lmp_type for lmp_type in LMP_TYPES])
+
+
+def run_benchmark(days=30, node_counts=NODE_COUNTS, seed=0):
+    """Times merge_panel_sources and add_panel_features for each node count and prints rows per second"""
+    rng = np.random.default_rng(seed)
+    hours = pd.date_range('2022-01-01', periods=days * 24, freq='H', tz='UTC', name=TIME_COL)
+    system_df = add_renewable_totals(synthetic_system(hours, rng))
+
+    results = []
+    for n_nodes in node_counts:
+        nodes = [f'NODE_{i:04d}' for i in range(n_nodes)]
+        rt_panel = synthetic_prices(hours, nodes, 'RT_', rng)
+        da_panel = synthetic_prices(hours, nodes, 'DA_', rng)
+
+        start_time = time.perf_counter()
+        panel_df = add_panel_features(merge_panel_sources(rt_panel, da_panel, system_df))
+        seconds = time.perf_counter() - start_time
+
+        results.append({'nodes': n_nodes, 'rows': len(panel_df), 'columns': panel_df.shape[1],
+                        'seconds': round(seconds, 3), 'rows_per_second': int(len(panel_df) / seconds)})
+        print(f"{n_nodes} nodes: {len(panel_df):,} rows in {seconds:.2f}s ({len(panel_df) / seconds:,.0f} rows/s)")
+
+        del panel_df, rt_panel, da_panel
+
+    return pd.DataFrame(results)
+
+
+if __name__ == '__main__':
+    run_benchmark(days=int(sys.argv[1]) if len(sys.argv) > 1 else 30)
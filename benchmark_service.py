@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the forecast service: latency of single forecasts and throughput of batch scoring over HTTP
+
+Run with an optional registry model name, e.g. python benchmark_service.py random_forest. Without one,
+a random forest the size of the notebook's is trained on synthetic data.
+
+"""
+import http.client
+import json
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+
+from forecast_service import ForecastService, make_server
+
+
+BATCH_SIZES = [10, 100, 1000]
+
+
+def synthetic_service(n_features=60, n_rows=5000, n_estimators=300, max_depth=10, seed=0):
+    """Returns a ForecastService around a random forest fit to synthetic data"""
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(n_rows, n_features)).astype('float32')
+    y = X[:, 0] * 3 + rng.normal(size=n_rows)
+    forest = RandomForestRegressor(n_estimators=n_estimators, max_depth=max_depth, min_samples_leaf=2,
+                                   n_jobs=-1, random_state=seed).fit(X, y)
+
+    return ForecastService(forest, [f'feature_{i}' for i in range(n_features)], 'sklearn', name='synthetic_forest')
+
+
+def _request(connection, method, path, payload=None, content_type='application/json'):
+    """Sends one request with an already encoded body on a kept-alive connection and returns the decoded reply"""
+    connection.request(method, path, body=payload, headers={'Content-Type': content_type})
+    response = connection.getresponse()
+    reply = json.loads(response.read())
+    if response.status != 200:
+        raise RuntimeError(f"{method} {path} returned {response.status}: {reply}")
+    return reply
+
+
+def run_benchmark(service=None, n_requests=2000, batch_sizes=BATCH_SIZES, seed=0):
+    """
+    Serves service on a free local port and measures it from a client on the same machine.
+
+    Latency is the client round trip of POST /observe with one new hour of features, which stores
+    the hour and returns its forecast. Throughput is measured for POST /forecast_batch at each of
+    batch_sizes rows per call, with JSON and with raw float32 bodies. Request bodies are encoded
+    before timing, so only the service and the connection are measured.
+
+    Returns:
+        DataFrame: One row per endpoint, body format and batch size with p50 / p90 / p99 / max
+        latency in ms, calls per second and rows per second.
+    """
+    service = service or synthetic_service(seed=seed)
+    server = make_server(service, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    rng = np.random.default_rng(seed)
+    connection = http.client.HTTPConnection(*server.server_address)
+    start_hour = pd.Timestamp('2023-01-01', tz='UTC')
+
+    def timed_calls(payloads, path, rows_per_call, content_type='application/json'):
+        # Warm up the connection and the model before timing
+        for payload in payloads[:10]:
+            _request(connection, 'POST', path, payload, content_type)
+
+        latencies = np.empty(len(payloads))
+        begin = time.perf_counter()
+        for i, payload in enumerate(payloads):
+            call_start = time.perf_counter()
+            _request(connection, 'POST', path, payload, content_type)
+            latencies[i] = time.perf_counter() - call_start
+        seconds = time.perf_counter() - begin
+
+        p50, p90, p99 = np.percentile(latencies, [50, 90, 99]) * 1000
+        return {'endpoint': path, 'body': content_type.split('/')[1], 'rows_per_call': rows_per_call,
+                'calls': len(payloads), 'p50_ms': round(p50, 3), 'p90_ms': round(p90, 3), 'p99_ms': round(p99, 3),
+                'max_ms': round(latencies.max() * 1000, 3), 'calls_per_second': int(len(payloads) / seconds),
+                'rows_per_second': int(len(payloads) * rows_per_call / seconds)}
+
+    results = []
+    try:
+        observations = rng.normal(size=(n_requests, len(service.features))).round(4)
+        payloads = [json.dumps({'time': (start_hour + pd.Timedelta(hours=i)).isoformat(),
+                                'values': dict(zip(service.features, observations[i].tolist()))})
+                    for i in range(n_requests)]
+        results.append(timed_calls(payloads, '/observe', 1))
+
+        for batch_size in batch_sizes:
+            batch = rng.normal(size=(batch_size, len(service.features))).round(4).astype('float32')
+            n_calls = max(20, min(n_requests, 20000 // batch_size))
+            results.append(timed_calls([json.dumps({'values': batch.tolist()})] * n_calls, '/forecast_batch', batch_size))
+            results.append(timed_calls([batch.tobytes()] * n_calls, '/forecast_batch', batch_size,
+                                       'application/octet-stream'))
+    finally:
+        connection.close()
+        server.shutdown()
+        server.server_close()
+
+    results = pd.DataFrame(results)
+    for row in results.itertuples():
+        print(f"{row.endpoint} ({row.body}) x{row.rows_per_call}: p50 {row.p50_ms:.2f} ms, p99 {row.p99_ms:.2f} ms, "
+              f"{row.calls_per_second:,} calls/s, {row.rows_per_second:,} rows/s")
+
+    return results
+
+
+if __name__ == '__main__':
+    run_benchmark(ForecastService.from_registry(sys.argv[1]) if len(sys.argv) > 1 else None)
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Manifest of the OASIS (query, node, window) ranges that have already been downloaded
+
+"""
+import json
+import os
+import threading
+
+import pandas as pd
+
+
+MANIFEST_PATH = 'Raw_Data/manifest.json'
+
+
+class CoverageManifest:
+    """
+    Records which query windows are on disk so that extraction only requests missing days.
+
+    The manifest is a json file mapping "query|node" to a list of [start, end) date pairs
+    formatted as 'YYYYMMDD'. It is rewritten atomically after every recorded window, so an
+    interrupted backfill keeps everything that finished before the interruption.
+
+    Parameters:
+        path (str): Location of the manifest json file.
+    """
+
+    def __init__(self, path=MANIFEST_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path) as f:
+                self.windows = json.load(f)
+        else:
+            self.windows = {}
+
+    @staticmethod
+    def _key(query_name, node):
+        return query_name + '|' + (node or 'ALL')
+
+    def record(self, query_name, node, start, end):
+        """
+        Marks the window [start, end) as downloaded for query_name / node.
+
+        Days from today onwards are not recorded because OASIS may not have published them in full.
+        """
+        today = pd.Timestamp.now(tz='America/Los_Angeles').strftime('%Y%m%d')
+        end = min(end, today)
+        if start >= end:
+            return
+
+        with self._lock:
+            self.windows.setdefault(self._key(query_name, node), []).append([start, end])
+            self._save()
+
+    def covered_days(self, query_name, node):
+        """Returns a DatetimeIndex of every day already downloaded for query_name / node"""
+        days = [pd.date_range(start, end, freq='D', inclusive='left')
+                for start, end in self.windows.get(self._key(query_name, node), [])]
+
+        if not days:
+            return pd.DatetimeIndex([])
+
+        return days[0].append(days[1:]).unique().sort_values()
+
+    def _save(self):
+        # Write to a temporary file first so a crash never leaves a truncated manifest behind
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self.windows, f, indent=1)
+        os.replace(temp_path, self.path)
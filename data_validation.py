@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+Data-quality rules for the raw store and the cleaned hourly data, checked with vectorized column operations
+
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from oasis_schema import OASIS_SCHEMAS, TIME_COL
+from raw_store import RAW_STORE_PATH, partition_files, read_query, to_utc
+
+
+# Spacing of consecutive intervals in each raw dataset
+RAW_INTERVALS = {'PRC_INTVL_LMP': '5min',
+                 'PRC_LMP': 'H',
+                 'ENE_SLRS': '5min',
+                 'SLD_REN_FCST': 'H'}
+
+# Plausible ranges for raw values. LMPs are bounded by the CAISO bid cap and floor with room for penalty prices
+RAW_VALUE_RANGES = {'PRC_INTVL_LMP': (-2000, 2000),
+                    'PRC_LMP': (-2000, 2000),
+                    'ENE_SLRS': (0, None),
+                    'SLD_REN_FCST': (0, None)}
+
+
+class Rule:
+    """
+    A named data-quality check.
+
+    Parameters:
+        name (str): Name used in the report, e.g. 'RT_LMP = sum(RT components)'.
+        check (function): Takes a DataFrame and returns a boolean array that is True for each violating row.
+    """
+
+    def __init__(self, name, check):
+        self.name = name
+        self.check = check
+
+    def __call__(self, df):
+        return np.asarray(self.check(df), dtype=bool)
+
+
+def _times(df, time_col):
+    """Returns the timestamps of df as int64 nanoseconds since the epoch (UTC), from time_col or the index"""
+    times = df[time_col] if time_col in df.columns else df.index
+    return pd.DatetimeIndex(times).asi8
+
+
+def _group_codes(df, by):
+    """Returns one int64 code per row identifying its combination of the by columns"""
+    codes = np.zeros(len(df), dtype='int64')
+    for col in by:
+        col_codes, labels = pd.factorize(df[col])
+        codes = codes * (len(labels) + 1) + col_codes + 1
+    return codes
+
+
+def component_sum_rule(total_col, component_cols, tolerance=0.01):
+    """Flags rows where total_col differs from the sum of component_cols by more than tolerance. Rows with NaN are skipped"""
+    def check(df):
+        total = df[total_col].to_numpy(dtype='float64', na_value=np.nan)
+        components = df[component_cols].to_numpy(dtype='float64', na_value=np.nan).sum(axis=1)
+        with np.errstate(invalid='ignore'):
+            return np.abs(total - components) > tolerance
+
+    return Rule(f"{total_col} = sum({', '.join(component_cols)})", check)
+
+
+def range_rule(col, low=None, high=None):
+    """Flags rows where col is below low or above high (either bound may be None). NaN is not flagged"""
+    def check(df):
+        values = df[col].to_numpy(dtype='float64', na_value=np.nan)
+        violations = np.zeros(len(values), dtype=bool)
+        with np.errstate(invalid='ignore'):
+            if low is not None:
+                violations |= values < low
+            if high is not None:
+                violations |= values > high
+        return violations
+
+    return Rule(f"{col} in [{low}, {high}]", check)
+
+
+def duplicate_interval_rule(by=(), time_col=TIME_COL):
+    """Flags every repeat of an interval that has already been seen for the same by columns, e.g. from overlapping download windows"""
+    by = list(by)
+
+    def check(df):
+        keys = pd.DataFrame({'time': _times(df, time_col), 'group': _group_codes(df, by)})
+        return keys.duplicated().to_numpy()
+
+    return Rule(f"unique intervals by {', '.join([time_col] + by)}", check)
+
+
+def coverage_rule(freq, by=(), time_col=TIME_COL):
+    """
+    Flags intervals that do not follow the previous interval of their series by exactly freq.
+
+    Intervals are compared in UTC, so a daylight saving day with a missing or doubled local hour
+    shows up as a gap or a duplicate instead of passing silently. The flagged row is the first
+    interval after a gap or the repeated interval.
+    """
+    by = list(by)
+    step = pd.tseries.frequencies.to_offset(freq).nanos
+
+    def check(df):
+        times = _times(df, time_col)
+        groups = _group_codes(df, by)
+
+        # Sort by series then time, and compare each interval to the previous one in the same series
+        order = np.lexsort((times, groups))
+        sorted_times, sorted_groups = times[order], groups[order]
+
+        violations = np.zeros(len(times), dtype=bool)
+        same_series = sorted_groups[1:] == sorted_groups[:-1]
+        violations[order[1:]] = same_series & (np.diff(sorted_times) != step)
+        return violations
+
+    return Rule(f"{time_col} every {freq}" + (f" per {', '.join(by)}" if by else ''), check)
+
+
+def raw_rules(dataset_name):
+    """Returns the default rules for a raw OASIS dataset: duplicates, interval coverage and value ranges"""
+    schema = OASIS_SCHEMAS[dataset_name]
+    low, high = RAW_VALUE_RANGES[dataset_name]
+
+    return [duplicate_interval_rule(by=schema['categories']),
+            coverage_rule(RAW_INTERVALS[dataset_name], by=schema['categories'])] + \
+           [range_rule(col, low, high) for col in schema['values']]
+
+
+def validate(df, rules, time_col=TIME_COL):
+    """
+    Runs every rule over df and summarises the violations.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Data to check, with timestamps in time_col or the index.
+    rules : list of Rule
+        Rules to run. Each one is a vectorized check over whole columns.
+
+    Returns
+    -------
+    report : DataFrame
+        One row per rule with the number of rows checked, the number of violations and the
+        timestamps of the first and last violation (NaT when there are none).
+    """
+    return pd.DataFrame(_rule_records(df, rules, time_col),
+                        columns=['rule', 'rows', 'violations', 'first_violation', 'last_violation'])
+
+
+def _rule_records(df, rules, time_col=TIME_COL, skip=0):
+    """Returns one report record per rule for df, leaving the first skip rows (context only) out of the counts"""
+    times = pd.to_datetime(_times(df, time_col)[skip:], utc=True)
+
+    records = []
+    for rule in rules:
+        violating = times[rule(df)[skip:]]
+        records.append({'rule': rule.name,
+                        'rows': len(df) - skip,
+                        'violations': len(violating),
+                        'first_violation': violating.min() if len(violating) else pd.NaT,
+                        'last_violation': violating.max() if len(violating) else pd.NaT})
+    return records
+
+
+def validate_raw(dataset_name, start=None, end=None, rules=None, where=None, store_path=RAW_STORE_PATH):
+    """
+    Runs rules (raw_rules(dataset_name) by default) over the stored rows of dataset_name between start and end (UTC).
+
+    Rows are read and checked one month partition at a time, so memory stays at one month of the
+    dataset however many months are stored. Each month is checked together with the last stored
+    interval of every series before it, so coverage_rule still sees gaps across month boundaries
+    (those carried rows are not counted again). Repeats of an interval are always in the same
+    month's partition, so duplicate_interval_rule sees them all.
+
+    Parameters:
+        where (dict): Column name -> list of values to check, as in read_query, e.g. the nodes the
+            pipeline uses. Defaults to every row.
+    """
+    schema = OASIS_SCHEMAS[dataset_name]
+    rules = raw_rules(dataset_name) if rules is None else rules
+    columns = [TIME_COL] + schema['categories'] + schema['values']
+
+    months = sorted({os.path.basename(os.path.dirname(path)).split('=')[-1]
+                     for path in partition_files(dataset_name, start, end, store_path)})
+
+    records = []
+    carried = None
+    for month in months:
+        month_start = pd.Timestamp(month + '-01', tz='UTC')
+        month_end = month_start + pd.offsets.MonthBegin(1)
+        if start is not None:
+            month_start = max(month_start, to_utc(start))
+        if end is not None:
+            month_end = min(month_end, to_utc(end))
+
+        df = read_query(dataset_name, columns=columns, start=month_start, end=month_end, where=where,
+                        store_path=store_path)
+        if len(df) == 0:
+            continue
+
+        skip = 0 if carried is None else len(carried)
+        if carried is not None:
+            df = pd.concat([carried, df], ignore_index=True)
+        records += _rule_records(df, rules, skip=skip)
+
+        # Last interval of every series, so the next month's first intervals are compared to it
+        df = df.sort_values(TIME_COL, kind='stable')
+        carried = df.groupby(schema['categories'], observed=True, sort=False).tail(1) if schema['categories'] \
+            else df.tail(1)
+
+    if not records:
+        return validate(pd.DataFrame(columns=columns), rules)
+
+    # Combine the months' records per rule
+    report = pd.DataFrame(records).groupby('rule', sort=False).agg(
+        rows=('rows', 'sum'), violations=('violations', 'sum'),
+        first_violation=('first_violation', 'min'), last_violation=('last_violation', 'max')).reset_index()
+    return report[['rule', 'rows', 'violations', 'first_violation', 'last_violation']]
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Long-to-wide reshaping of OASIS tables by scattering values into a preallocated matrix
+
+"""
+import numpy as np
+import pandas as pd
+
+
+def _codes(series):
+    """Returns (codes, labels) for series with only the observed labels, in sorted order"""
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        codes, labels = pd.factorize(series, sort=True)
+        return codes.astype('int64'), pd.Index(labels)
+
+    # Reuse the categorical codes and remap them through a small lookup table, so unused
+    # categories are dropped and the rest sorted without another pass over the labels
+    categories = series.cat.categories
+    codes = series.cat.codes.to_numpy().astype('int64')
+    used = np.flatnonzero(np.bincount(codes[codes >= 0], minlength=len(categories)))
+    used = used[np.argsort(categories[used])]
+
+    # The extra last entry keeps missing values (code -1) at -1
+    lookup = np.full(len(categories) + 1, -1, dtype='int64')
+    lookup[used] = np.arange(len(used))
+    return lookup[codes], categories[used]
+
+
+def pivot_long_to_wide(df, index, columns, values, sep='_', dtype='float32'):
+    """
+    Reshapes a long table to wide format like DataFrame.pivot, without building a MultiIndex.
+
+    The index and column keys are factorised once into integer codes and each value is scattered
+    into a preallocated (n_index, n_columns) matrix at (index code, column code). Duplicate keys
+    (e.g. rows repeated by overlapping downloads) are averaged and reported instead of raising.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Long table.
+    index : str or list of str
+        Column(s) whose values become the row index, e.g. 'INTERVALSTARTTIME_GMT'. Multiple
+        columns give a MultiIndex with only the combinations that occur, e.g. ['NODE', 'INTERVALSTARTTIME_GMT'].
+    columns : str or list of str
+        Column(s) whose values become the column names. Multiple keys are joined with sep,
+        e.g. ['TRADING_HUB', 'RENEWABLE_TYPE', 'LABEL'] -> 'NP15_Solar_Renewable Forecast Day Ahead'.
+    values : str
+        Column holding the values.
+
+    Returns
+    -------
+    wide_df : DataFrame
+        Sorted index and sorted columns (observed key combinations only), dtype float32 by default.
+    """
+    index = [index] if isinstance(index, str) else list(index)
+    columns = [columns] if isinstance(columns, str) else list(columns)
+
+    if len(index) == 1:
+        row_codes, row_labels = _codes(df[index[0]])
+        row_labels = pd.Index(row_labels, name=index[0])
+        has_key = row_codes >= 0
+    else:
+        # Combine the index keys like the column keys below. The combinations can be many
+        # (nodes x hours), so the observed ones are found with a sort instead of a lookup table
+        combined_rows = np.zeros(len(df), dtype='int64')
+        level_codes, levels = [], []
+        has_key = np.ones(len(df), dtype=bool)
+        for col in index:
+            codes, labels = _codes(df[col])
+            combined_rows = combined_rows * len(labels) + codes
+            has_key &= codes >= 0
+            levels.append(labels)
+
+        observed_rows, row_codes = np.unique(np.where(has_key, combined_rows, -1), return_inverse=True)
+        row_codes = row_codes.reshape(-1)
+        if not has_key.all():
+            observed_rows, row_codes = observed_rows[1:], row_codes - 1
+
+        for labels in reversed(levels):
+            observed_rows, codes = np.divmod(observed_rows, len(labels))
+            level_codes.insert(0, codes)
+        row_labels = pd.MultiIndex(levels=levels, codes=level_codes, names=index)
+
+    # Combine the column keys into a single code and keep only the combinations that occur
+    combined = np.zeros(len(df), dtype='int64')
+    key_labels = []
+    for col in columns:
+        codes, labels = _codes(df[col])
+        combined = combined * len(labels) + codes
+        key_labels.append(labels)
+        has_key &= codes >= 0
+
+    # Rows with a missing key have no cell to go to (pandas pivot drops them as well)
+    if not has_key.all():
+        row_codes, combined = row_codes[has_key], combined[has_key]
+
+    # The key space is small (labels per key multiplied together), so a lookup table replaces a sort
+    key_space = int(np.prod([len(labels) for labels in key_labels]))
+    observed = np.flatnonzero(np.bincount(combined, minlength=key_space))
+    lookup = np.full(key_space, -1, dtype='int64')
+    lookup[observed] = np.arange(len(observed))
+    col_codes = lookup[combined]
+
+    # Decode each observed combination back into its labels
+    col_names = []
+    for code in observed:
+        parts = []
+        for labels in reversed(key_labels):
+            code, part = divmod(code, len(labels))
+            parts.append(str(labels[part]))
+        col_names.append(sep.join(reversed(parts)))
+
+    n_rows, n_cols = len(row_labels), len(observed)
+    flat = row_codes * n_cols + col_codes
+    vals = df[values].to_numpy(dtype='float64', na_value=np.nan)
+    if not has_key.all():
+        vals = vals[has_key]
+
+    counts = np.bincount(flat, minlength=n_rows * n_cols)
+    duplicates = int((counts > 1).sum())
+
+    if duplicates:
+        print(f"pivot_long_to_wide: {duplicates} duplicate ({', '.join(index + columns)}) keys averaged")
+        valid = ~np.isnan(vals)
+        sums = np.bincount(flat[valid], weights=vals[valid], minlength=n_rows * n_cols)
+        valid_counts = np.bincount(flat[valid], minlength=n_rows * n_cols)
+        with np.errstate(invalid='ignore'):
+            matrix = (sums / valid_counts).astype(dtype).reshape(n_rows, n_cols)
+    else:
+        matrix = np.full(n_rows * n_cols, np.nan, dtype=dtype)
+        matrix[flat] = vals
+        matrix = matrix.reshape(n_rows, n_cols)
+
+    return pd.DataFrame(matrix, index=row_labels, columns=col_names, copy=False)
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorized feature engineering helpers used by DataCleaning.py
+
+"""
+import numpy as np
+import pandas as pd
+
+
+def create_shifted_columns(df, shifts):
+    """
+    Creates lagged and future copies of columns in df with one vectorized lookup per distinct shift.
+
+    For every timestamp in df.index the value at timestamp + shift_hours is taken from the source
+    column. If that timestamp is not in the index the result is NaN, so gaps in the hourly data are
+    never bridged by a positional shift.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Data with a unique DatetimeIndex, or a unique integer index of time steps (e.g. epoch
+        5-minute intervals), in which case shifts are in steps rather than hours.
+    shifts : dict
+        New column name -> (source column name, shift_hours). Negative shift_hours create lags and
+        positive shift_hours create future (target) values.
+
+    Returns
+    -------
+    shifted_df : DataFrame
+        float64 columns named by the keys of shifts, in the same order, indexed like df.
+    """
+    # Group the requested columns by shift so each shift needs only one index lookup
+    cols_by_shift = {}
+    for col_name, shift_hours in shifts.values():
+        cols_by_shift.setdefault(shift_hours, []).append(col_name)
+
+    shifted_blocks = {}
+    for shift_hours, col_names in cols_by_shift.items():
+        col_names = list(dict.fromkeys(col_names))
+        offset = shift_hours if pd.api.types.is_integer_dtype(df.index) else pd.Timedelta(hours=shift_hours)
+        positions = df.index.get_indexer(df.index + offset)
+
+        block = df[col_names].to_numpy(dtype='float64', na_value=np.nan)[positions]
+        block[positions == -1] = np.nan
+
+        for i, col_name in enumerate(col_names):
+            shifted_blocks[(col_name, shift_hours)] = block[:, i]
+
+    return pd.DataFrame({new_col: shifted_blocks[source] for new_col, source in shifts.items()}, index=df.index)
+
+
+def spike_flags(values, thresholds):
+    """
+    Flags values at or above each threshold using a single searchsorted pass.
+
+    Parameters
+    ----------
+    values : array-like of shape (n_samples,)
+        Prices to compare, e.g. RT_LMP. NaN is never flagged.
+    thresholds : list of float
+        Spike thresholds in any order.
+
+    Returns
+    -------
+    flags : ndarray of shape (n_samples, len(thresholds))
+        int8 array with column j equal to 1 where values >= thresholds[j].
+    """
+    values = np.asarray(values, dtype='float64')
+    thresholds = np.asarray(thresholds, dtype='float64')
+    order = np.argsort(thresholds)
+
+    # Number of (sorted) thresholds each value reaches. NaN sorts past every threshold, so reset it to 0
+    levels = np.searchsorted(thresholds[order], values, side='right')
+    levels[np.isnan(values)] = 0
+
+    # Value reaches threshold j when its level passes the rank of threshold j
+    ranks = np.empty(len(thresholds), dtype='int64')
+    ranks[order] = np.arange(len(thresholds))
+    return (levels[:, None] > ranks[None, :]).astype('int8')
+
+
+def calendar_features(index):
+    """
+    Builds the calendar features for a tz-aware DatetimeIndex in local time.
+
+    Returns
+    -------
+    calendar_df : DataFrame
+        friday, weekend, hour, on_peak_hour and month as int8 and the cyclical encodings
+        sin_month, cos_month, sin_hour and cos_hour as float32, indexed like index.
+    """
+    weekday = index.weekday.to_numpy()
+    hour = index.hour.to_numpy().astype('int8')
+    month = index.month.to_numpy().astype('int8')
+
+    return pd.DataFrame({'friday': (weekday == 4).astype('int8'),
+                         'weekend': (weekday > 4).astype('int8'),
+                         'hour': hour,
+                         'on_peak_hour': ((hour >= 16) & (hour <= 21)).astype('int8'),
+                         'month': month,
+                         'sin_month': np.sin(2 * np.pi * month / 12.0).astype('float32'),
+                         'cos_month': np.cos(2 * np.pi * month / 12.0).astype('float32'),
+                         'sin_hour': np.sin(2 * np.pi * hour / 24.0).astype('float32'),
+                         'cos_hour': np.cos(2 * np.pi * hour / 24.0).astype('float32')},
+                        index=index)
+
+
+def create_panel_shifted_columns(df, shifts):
+    """
+    Creates lagged and future copies of columns for every node of a (node, hour) panel at once.
+
+    Works like create_shifted_columns within each node: the value at (node, timestamp + shift_hours)
+    is looked up and the result is NaN where that row does not exist, so neither gaps nor the edges
+    between nodes are bridged. Each row is located by an integer (node, hour) key with one
+    searchsorted per distinct shift, so the cost grows with the number of rows, not with a loop
+    over nodes.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Panel indexed by a unique (node, hourly timestamp) MultiIndex.
+    shifts : dict
+        New column name -> (source column name, shift_hours), as in create_shifted_columns.
+
+    Returns
+    -------
+    shifted_df : DataFrame
+        float64 columns named by the keys of shifts, in the same order, indexed like df.
+    """
+    node_codes = pd.factorize(df.index.get_level_values(0))[0].astype('int64')
+    hours = df.index.get_level_values(1).asi8 // (3600 * 10**9)
+
+    # Hours are offset from the first hour so each node owns a disjoint range of keys
+    first_hour = hours.min() if len(hours) else 0
+    span = int(hours.max() - first_hour + 1) if len(hours) else 1
+    keys = node_codes * span + (hours - first_hour)
+
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+
+    cols_by_shift = {}
+    for col_name, shift_hours in shifts.values():
+        cols_by_shift.setdefault(shift_hours, []).append(col_name)
+
+    shifted_blocks = {}
+    for shift_hours, col_names in cols_by_shift.items():
+        col_names = list(dict.fromkeys(col_names))
+
+        # Rows whose shifted hour leaves the panel's range have no source row
+        target_hours = hours - first_hour + shift_hours
+        in_range = (target_hours >= 0) & (target_hours < span)
+
+        found = np.searchsorted(sorted_keys, node_codes * span + target_hours)
+        found = np.minimum(found, len(sorted_keys) - 1)
+        matched = in_range & (sorted_keys[found] == node_codes * span + target_hours)
+        positions = order[found]
+
+        block = df[col_names].to_numpy(dtype='float64', na_value=np.nan)[positions]
+        block[~matched] = np.nan
+
+        for i, col_name in enumerate(col_names):
+            shifted_blocks[(col_name, shift_hours)] = block[:, i]
+
+    return pd.DataFrame({new_col: shifted_blocks[source] for new_col, source in shifts.items()}, index=df.index)
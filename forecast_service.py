@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+"""
+Local HTTP service returning the RT LMP forecast 2 hours ahead from a registered model, keeping the
+model and the latest 24 hours of features in memory
+
+Run with a registry model name and an optional port, e.g. python forecast_service.py random_forest 8765
+
+Endpoints (JSON):
+    POST /observe         {"time": ..., "values": {feature: value}}  stores an hour and returns its forecast
+    GET  /forecast        forecast from the latest stored hour
+    POST /forecast_batch  {"rows": [{feature: value}, ...]} or {"values": [[...], ...]}  scores many hours or
+                          nodes in one call (values are windows of shape (n, 24, n_features) for RNN models).
+                          With Content-Type application/octet-stream the body is the values as raw float32
+                          in C order, which skips JSON parsing for large batches
+    GET  /health          model, version and latest stored hour
+
+"""
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+from hourly_panel import HOUR_NS, LOCAL_TZ
+from model_registry import forest_arrays, load_model
+
+
+HORIZON_HOURS = 2
+WINDOW_HOURS = 24
+
+
+class FlatForest:
+    """
+    Averaging tree ensemble (RandomForestRegressor, ExtraTreesRegressor) flattened into a few arrays for fast prediction.
+
+    All trees are walked together, one tree level per step, with numpy gathers over the
+    concatenated node arrays. This avoids the per-tree Python and joblib overhead of
+    forest.predict, which dominates when scoring one row at a time.
+
+    Parameters:
+        arrays (dict): Node arrays from model_registry.forest_arrays, possibly memory-mapped.
+    """
+
+    def __init__(self, arrays):
+        # Leaves point to themselves, so extra steps past a leaf leave it in place
+        self.left = arrays['left']
+        self.right = arrays['right']
+        self.feature = arrays['feature']
+        self.threshold = arrays['threshold']
+        self.value = arrays['value']
+        self.roots = arrays['roots']
+        self.depth = int(arrays['depth'])
+
+    def predict(self, X):
+        """Returns the forest's mean prediction for each row of the 2-D array X"""
+        X = np.ascontiguousarray(X)
+        flat_X = X.reshape(-1)
+        row_starts = (np.arange(len(X)) * X.shape[1])[:, None]
+
+        nodes = np.broadcast_to(self.roots, (len(X), len(self.roots)))
+        for _ in range(self.depth):
+            go_left = flat_X.take(row_starts + self.feature.take(nodes)) <= self.threshold.take(nodes)
+            nodes = np.where(go_left, self.left.take(nodes), self.right.take(nodes))
+        return self.value.take(nodes).mean(axis=1)
+
+
+def make_predictor(model, kind):
+    """Returns a function mapping a float32 input array to a 1-D array of predictions, using the fastest path for the model"""
+    if kind == 'sklearn' and forest_arrays(model) is not None:
+        return FlatForest(forest_arrays(model)).predict
+    if kind == 'xgboost':
+        booster = model.get_booster()
+        return lambda X: np.asarray(booster.inplace_predict(X)).reshape(-1)
+    if kind == 'keras':
+        # Calling the model directly skips the batching machinery of model.predict
+        return lambda X: np.asarray(model(X, training=False)).reshape(-1)
+    return lambda X: np.asarray(model.predict(X)).reshape(-1)
+
+
+def _epoch_hour(timestamp):
+    """Returns the UTC hour since the epoch of a timestamp (read in LOCAL_TZ if it has no timezone)"""
+    timestamp = pd.Timestamp(timestamp)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.tz_localize(LOCAL_TZ)
+    return int(timestamp.value // HOUR_NS)
+
+
+def _format_hour(hour):
+    return pd.Timestamp(hour * HOUR_NS, tz='UTC').tz_convert(LOCAL_TZ).isoformat()
+
+
+class ForecastService:
+    """
+    Forecasts from an in-memory model and a ring buffer of the latest hours of features.
+
+    Row hour % window_hours of the buffer holds that hour's features, so storing an hour and
+    reading the last window_hours are array writes and reads with no reallocation. Scalers saved
+    with the model (scaler_X, scaler_y) are applied to inputs and forecasts.
+
+    Parameters:
+        model (object): Fitted model.
+        features (list): Input columns, in model order.
+        kind (str): 'sklearn', 'xgboost' or 'keras', as in the model registry.
+        scalers (dict): Optional fitted 'scaler_X' and 'scaler_y'.
+        window_hours (int): Hours kept, and the input window of sequence (RNN) models.
+        name (str): Model name reported by /health.
+        version (str): Model version reported by /health.
+    """
+
+    def __init__(self, model, features, kind, scalers=None, window_hours=WINDOW_HOURS, name=None, version=None):
+        self.features = list(features)
+        self.scalers = scalers or {}
+        self.window_hours = window_hours
+        self.name = name
+        self.version = version
+        self.sequence = kind == 'keras' and len(model.input_shape) == 3
+        self.predict = make_predictor(model, kind)
+
+        self.values = np.full((window_hours, len(self.features)), np.nan, dtype='float32')
+        self.hours = np.full(window_hours, -1, dtype='int64')
+        self.latest_hour = None
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_registry(cls, name, version=None, **kwargs):
+        """
+        Builds a service for a model in the registry (the newest version by default).
+
+        Forests are served from their memory-mapped node arrays without unpickling the fitted trees.
+        """
+        registered = load_model(name, version, forest_only=True, **kwargs)
+        model = FlatForest(registered.forest) if registered.forest is not None else registered.model
+        return cls(model, registered.features, registered.meta['kind'], registered.scalers,
+                   name=name, version=registered.version)
+
+    def _row(self, values):
+        """Returns a float32 row of features in model order from a dict, or from a list already in that order"""
+        if isinstance(values, dict):
+            missing = [col for col in self.features if col not in values]
+            if missing:
+                raise KeyError(f"Missing features: {', '.join(missing)}")
+            return np.array([values[col] for col in self.features], dtype='float32')
+        return np.asarray(values, dtype='float32').reshape(len(self.features))
+
+    def _score(self, X):
+        """Scales X, predicts and unscales the predictions"""
+        scaler_X, scaler_y = self.scalers.get('scaler_X'), self.scalers.get('scaler_y')
+        if scaler_X is not None:
+            # MinMaxScaler transform as plain arithmetic, skipping its input validation
+            X = (X * scaler_X.scale_ + scaler_X.min_).astype('float32')
+        if np.isnan(X).any():
+            raise ValueError("Inputs contain missing values")
+
+        y = self.predict(np.ascontiguousarray(X))
+        if scaler_y is not None:
+            y = (y - scaler_y.min_[0]) / scaler_y.scale_[0]
+        return y
+
+    def observe(self, timestamp, values):
+        """Stores the features of an hour, replacing the hour window_hours earlier, and returns the forecast from it"""
+        hour = _epoch_hour(timestamp)
+        row = self._row(values)
+        with self.lock:
+            self.values[hour % self.window_hours] = row
+            self.hours[hour % self.window_hours] = hour
+            self.latest_hour = hour if self.latest_hour is None else max(self.latest_hour, hour)
+        return self.forecast(hour)
+
+    def forecast(self, hour=None):
+        """Returns the forecast made at hour (the latest stored hour by default) for HORIZON_HOURS later"""
+        with self.lock:
+            hour = self.latest_hour if hour is None else hour
+            if hour is None:
+                raise LookupError("No hours stored yet")
+
+            if self.sequence:
+                window = np.arange(hour - self.window_hours + 1, hour + 1)
+                positions = window % self.window_hours
+                if (self.hours[positions] != window).any():
+                    raise LookupError(f"The {self.window_hours} hours up to {_format_hour(hour)} are not all stored")
+                X = self.values[positions][None]
+            else:
+                if self.hours[hour % self.window_hours] != hour:
+                    raise LookupError(f"Hour {_format_hour(hour)} is not stored")
+                X = self.values[hour % self.window_hours][None]
+
+        return {'time': _format_hour(hour),
+                'target_time': _format_hour(hour + HORIZON_HOURS),
+                'forecast': float(self._score(X)[0])}
+
+    def forecast_batch(self, rows=None, values=None):
+        """
+        Scores many hours or nodes in one model call.
+
+        rows is a list of feature dicts (tabular models); values is an array of rows in model
+        order, or of windows of shape (n, window_hours, n_features) for sequence models.
+        """
+        if rows is not None:
+            X = np.stack([self._row(row) for row in rows]) if len(rows) else np.empty((0, len(self.features)), 'float32')
+        else:
+            X = np.asarray(values, dtype='float32')
+        if len(X) == 0:
+            return []
+        return self._score(X).tolist()
+
+    def health(self):
+        return {'model': self.name,
+                'version': self.version,
+                'features': len(self.features),
+                'latest_time': None if self.latest_hour is None else _format_hour(self.latest_hour)}
+
+
+class ForecastHandler(BaseHTTPRequestHandler):
+    """JSON request handler for a ForecastService, kept alive between requests so each call is a single round trip"""
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    service = None
+
+    def _reply(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _handle(self, action):
+        try:
+            self._reply(200, action())
+        except (KeyError, ValueError, TypeError) as e:
+            self._reply(400, {'error': str(e)})
+        except LookupError as e:
+            self._reply(404, {'error': str(e)})
+
+    def _body(self):
+        """Reads the whole request body and returns it parsed, raising ValueError if it is malformed"""
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            # The body cannot be skipped without its length, so the connection cannot be reused
+            self.close_connection = True
+            raise ValueError("Invalid Content-Length")
+        payload = self.rfile.read(length) if length else b''
+
+        if self.headers.get('Content-Type') == 'application/octet-stream':
+            return {'values': self._binary_values(payload)}
+        body = json.loads(payload) if payload else {}
+        if not isinstance(body, dict):
+            raise ValueError("The request body must be a JSON object")
+        return body
+
+    def _binary_values(self, payload):
+        """Reads raw float32 rows (or windows, for sequence models) without copying"""
+        shape = (-1, self.service.window_hours, len(self.service.features)) if self.service.sequence \
+            else (-1, len(self.service.features))
+        return np.frombuffer(payload, dtype='float32').reshape(shape)
+
+    def do_GET(self):
+        if self.path == '/forecast':
+            self._handle(self.service.forecast)
+        elif self.path == '/health':
+            self._handle(self.service.health)
+        else:
+            self._reply(404, {'error': 'Unknown endpoint ' + self.path})
+
+    def _post(self):
+        # The body is read for every path, so an unknown endpoint still leaves the connection usable
+        body = self._body()
+        if self.path == '/observe':
+            return self.service.observe(body['time'], body['values'])
+        if self.path == '/forecast_batch':
+            return {'forecasts': self.service.forecast_batch(body.get('rows'), body.get('values'))}
+        raise LookupError('Unknown endpoint ' + self.path)
+
+    def do_POST(self):
+        # Parsing happens inside _handle, so a malformed body gets a 400 instead of a dropped connection
+        self._handle(self._post)
+
+    def log_message(self, format, *args):
+        # Per-request logging to stderr would cost more than the forecast itself
+        pass
+
+
+def make_server(service, host='127.0.0.1', port=8765):
+    """Returns an HTTP server for service (port 0 picks a free port); call serve_forever() on it to start serving"""
+    handler = type('BoundForecastHandler', (ForecastHandler,), {'service': service})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+if __name__ == '__main__':
+    server = make_server(ForecastService.from_registry(sys.argv[1]), port=int(sys.argv[2]) if len(sys.argv) > 2 else 8765)
+    print(f"Serving {sys.argv[1]} forecasts on http://{server.server_address[0]}:{server.server_address[1]}")
+    server.serve_forever()
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Out-of-core aggregation of 5-minute OASIS intervals to hourly means
+
+"""
+import pandas as pd
+import pyarrow.dataset as ds
+
+from oasis_schema import TIME_COL
+from raw_store import RAW_STORE_PATH, arrow_schema, build_filter, partition_files
+
+
+# Raw rows held in memory at once
+BATCH_ROWS = 500_000
+
+
+def iter_hourly_means(dataset_name, label_col, value_col, start=None, end=None, where=None, by=(),
+                      batch_size=BATCH_ROWS, store_path=RAW_STORE_PATH):
+    """
+    Streams hourly means of value_col for each label_col value from the raw store.
+
+    Stored files are read in time order, batch_size rows at a time, and reduced to per-hour
+    sums and counts, so memory stays at one batch plus one window of hourly partials no matter
+    how many nodes or years are stored. Files hold non-overlapping windows, so only the last
+    hour of a file can continue in the next file. That hour is carried over until the next file
+    has been added to it.
+
+    Parameters:
+        dataset_name (str): Raw store dataset, e.g. 'PRC_INTVL_LMP'.
+        label_col (str): Column whose values become the output columns, e.g. 'LMP_TYPE'.
+        value_col (str): Column averaged within each hour, e.g. 'VALUE'.
+        start, end (str or Timestamp): Optional UTC bounds on INTERVALSTARTTIME_GMT, as in read_query.
+        where (dict): Column name -> list of values to keep, as in read_query.
+        by (list): Extra columns kept as index levels after the hour, e.g. ['NODE'] for one row per node and hour.
+
+    Yields:
+        DataFrame: Hourly means indexed by UTC hour (and the by columns) with one float32 column per label, in time order.
+    """
+    schema = arrow_schema(dataset_name)
+    condition = build_filter(start, end, where)
+
+    by = list(by)
+    carried = None
+
+    for path in partition_files(dataset_name, start, end, store_path):
+        partials = [] if carried is None else [carried]
+        last_hour = None
+
+        for batch in ds.dataset(path, schema=schema, format='parquet').to_batches(
+                columns=[TIME_COL] + by + [label_col, value_col], filter=condition, batch_size=batch_size):
+            if batch.num_rows == 0:
+                continue
+
+            df = batch.to_pandas()
+            hours = df[TIME_COL].dt.floor('H')
+            keys = [hours] + [df[col].astype(str) for col in by + [label_col]]
+            partials.append(df[value_col].astype('float64').groupby(keys).agg(['sum', 'count']))
+
+            batch_last_hour = hours.max()
+            last_hour = batch_last_hour if last_hour is None else max(last_hour, batch_last_hour)
+
+        if not partials:
+            continue
+
+        totals = pd.concat(partials)
+        totals = totals.groupby(level=list(range(totals.index.nlevels))).sum()
+
+        if last_hour is None:
+            carried = totals
+            continue
+
+        # Everything before the file's last hour is complete
+        complete = totals.index.get_level_values(0) < last_hour
+        carried = totals[~complete]
+
+        if complete.any():
+            yield _to_means(totals[complete])
+
+    if carried is not None and len(carried):
+        yield _to_means(carried)
+
+
+def _to_means(totals):
+    means = (totals['sum'] / totals['count'].where(totals['count'] > 0)).unstack(level=-1)
+    means.index = means.index.set_names([TIME_COL] + means.index.names[1:])
+    means.columns.name = None
+    return means.sort_index(axis=1).astype('float32')
+
+
+def hourly_means(dataset_name, label_col, value_col, start=None, end=None, where=None, by=(), batch_size=BATCH_ROWS):
+    """Returns every hourly chunk from iter_hourly_means combined into one DataFrame"""
+    chunks = list(iter_hourly_means(dataset_name, label_col, value_col, start, end, where, by, batch_size))
+    if not chunks:
+        return pd.DataFrame(index=pd.DatetimeIndex([], tz='UTC', name=TIME_COL))
+    return pd.concat(chunks).sort_index(axis=1)
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Single-pass alignment of the hourly sources onto one canonical UTC index
+
+"""
+import numpy as np
+import pandas as pd
+
+from oasis_schema import TIME_COL
+
+
+def align_hourly_sources(sources, how='inner'):
+    """
+    Joins hourly DataFrames by placing each one's columns into a single preallocated block.
+
+    All source indexes are mapped once onto a canonical hourly UTC index spanning every source.
+    Only the output rows are allocated, so memory stays near one copy of the final table instead
+    of one copy per pairwise merge.
+
+    Parameters
+    ----------
+    sources : dict
+        Source name -> DataFrame indexed by unique, on-the-hour UTC timestamps.
+    how : str
+        'inner' keeps only hours present in every source (the behaviour of chained inner merges).
+        'outer' keeps every hour in the canonical range and leaves missing values as NaN.
+
+    Returns
+    -------
+    df : DataFrame
+        All source columns, in source order, indexed by UTC hour.
+    gap_report : DataFrame
+        One row per canonical hour that is missing from at least one source, with a boolean
+        column per source that is True where that source has no data for the hour. When how is
+        'inner' these are exactly the hours dropped from df.
+    """
+    names = list(sources)
+    frames = [sources[name] for name in names]
+
+    # Canonical hourly index covering every source
+    first_hour = min(frame.index.min() for frame in frames if len(frame))
+    last_hour = max(frame.index.max() for frame in frames if len(frame))
+    canonical = pd.date_range(first_hour, last_hour, freq='H', name=TIME_COL)
+
+    positions = [canonical.get_indexer(frame.index) for frame in frames]
+    for name, frame, pos in zip(names, frames, positions):
+        if (pos == -1).any():
+            raise ValueError(f"Source {name} has timestamps that are not on the hour: {frame.index[pos == -1][:3].tolist()}")
+
+    present = np.zeros((len(canonical), len(frames)), dtype=bool)
+    for i, pos in enumerate(positions):
+        present[pos, i] = True
+
+    keep = present.all(axis=1) if how == 'inner' else np.ones(len(canonical), dtype=bool)
+
+    # Output row of each canonical hour (-1 where the hour is dropped)
+    out_row = np.full(len(canonical), -1)
+    out_row[keep] = np.arange(keep.sum())
+
+    columns = [col for frame in frames for col in frame.columns]
+    dtype = np.result_type(*[dtype for frame in frames for dtype in frame.dtypes])
+    block = np.full((int(keep.sum()), len(columns)), np.nan, dtype=dtype)
+
+    col_start = 0
+    for frame, pos in zip(frames, positions):
+        rows = out_row[pos]
+        kept = rows >= 0
+        block[rows[kept], col_start:col_start + frame.shape[1]] = frame.to_numpy()[kept]
+        col_start += frame.shape[1]
+
+    df = pd.DataFrame(block, index=canonical[keep], columns=columns, copy=False)
+
+    missing = ~present.all(axis=1)
+    gap_report = pd.DataFrame(~present[missing], index=canonical[missing], columns=names)
+
+    return df, gap_report
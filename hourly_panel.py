@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+Dense hourly dataset addressed by integer UTC hour offset instead of a tz-aware DatetimeIndex
+
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+
+HOUR_NS = 3600 * 10**9
+LOCAL_TZ = 'America/Los_Angeles'
+
+# Rows written per chunk when saving, so saving never holds a second copy of a large panel
+SAVE_CHUNK_ROWS = 1 << 16
+
+
+class HourlyPanel:
+    """
+    Hourly data as contiguous float32 columns, one row per UTC hour from start_hour, with a validity mask.
+
+    Row t holds the hour start_hour + t (hours since the epoch), so finding, shifting and slicing
+    hours is integer arithmetic instead of DatetimeIndex lookups, and daylight saving time never
+    enters into it. Hours without data are rows of NaN with valid set to False.
+
+    Parameters:
+        values (ndarray): (n_hours, n_columns) float32 array, ideally column-major so each column is contiguous. Not copied.
+        columns (list): Column names.
+        start_hour (int): UTC hour of the first row, in hours since the epoch.
+        valid (ndarray): (n_hours,) bool array, True for hours with data. Defaults to every hour.
+    """
+
+    def __init__(self, values, columns, start_hour, valid=None):
+        self.values = np.asarray(values, dtype='float32')
+        self.columns = list(columns)
+        self.start_hour = int(start_hour)
+        self.valid = np.ones(len(self.values), dtype=bool) if valid is None else np.asarray(valid, dtype=bool)
+        self._positions = {col: i for i, col in enumerate(self.columns)}
+
+    @classmethod
+    def from_frame(cls, df, columns=None):
+        """
+        Builds a panel from a DataFrame indexed by tz-aware hourly timestamps.
+
+        If the index already covers every hour once, in order, and the columns are float32 in a
+        single block, the panel shares the DataFrame's memory. Otherwise the rows are scattered
+        onto the dense hourly grid and hours absent from df are marked invalid.
+        """
+        columns = list(df.columns) if columns is None else list(columns)
+        frame = df[columns] if columns != list(df.columns) else df
+        hours = frame.index.asi8 // HOUR_NS
+
+        if len(hours) == 0:
+            return cls(np.empty((0, len(columns)), dtype='float32'), columns, 0)
+
+        start_hour = int(hours.min())
+        n_hours = int(hours.max()) - start_hour + 1
+
+        if n_hours == len(hours) and (np.diff(hours) == 1).all():
+            # Already dense. to_numpy returns a view for a single float32 block
+            values = frame.to_numpy(dtype='float32', copy=False)
+            return cls(values, columns, start_hour)
+
+        values = np.full((n_hours, len(columns)), np.nan, dtype='float32', order='F')
+        values[hours - start_hour] = frame.to_numpy(dtype='float32', na_value=np.nan)
+        valid = np.zeros(n_hours, dtype=bool)
+        valid[hours - start_hour] = True
+
+        return cls(values, columns, start_hour, valid)
+
+    def to_frame(self, tz=LOCAL_TZ):
+        """Returns every hour as a DataFrame indexed by timestamps in tz, sharing the panel's memory"""
+        return pd.DataFrame(self.values, index=self.index(tz), columns=self.columns, copy=False)
+
+    def __len__(self):
+        return len(self.values)
+
+    @property
+    def end_hour(self):
+        """UTC hour after the last row, in hours since the epoch"""
+        return self.start_hour + len(self.values)
+
+    def index(self, tz=LOCAL_TZ):
+        """Returns the timestamp of every row in tz"""
+        return pd.DatetimeIndex(np.arange(self.start_hour, self.end_hour, dtype='int64') * HOUR_NS).tz_localize('UTC').tz_convert(tz)
+
+    def offset(self, timestamp, tz=LOCAL_TZ):
+        """Returns the row offset of timestamp (a Timestamp or string, read in tz if it has no timezone)"""
+        timestamp = pd.Timestamp(timestamp)
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.tz_localize(tz)
+        return int(timestamp.value // HOUR_NS) - self.start_hour
+
+    def column(self, name):
+        """Returns a column as a view of the panel's memory"""
+        return self.values[:, self._positions[name]]
+
+    def columns_array(self, names):
+        """Returns the named columns as an (n_hours, len(names)) array, a view if they are adjacent and in order"""
+        positions = [self._positions[name] for name in names]
+        if positions == list(range(positions[0], positions[0] + len(positions))):
+            return self.values[:, positions[0]:positions[-1] + 1]
+        return self.values[:, positions]
+
+    def shift(self, hours, columns=None):
+        """
+        Returns the values hours later (earlier when negative) than each row.
+
+        Row t of the result holds row t + hours, or NaN where that row is invalid or outside the panel.
+        """
+        source = self.values if columns is None else self.columns_array(columns)
+        valid_source = np.where(self.valid[:, None], source, np.nan)
+
+        shifted = np.full(source.shape, np.nan, dtype='float32')
+        if abs(hours) >= len(source):
+            return shifted
+        if hours >= 0:
+            shifted[:len(source) - hours] = valid_source[hours:]
+        else:
+            shifted[-hours:] = valid_source[:len(source) + hours]
+        return shifted
+
+    def slice(self, start=None, end=None, tz=LOCAL_TZ):
+        """
+        Returns the rows from start up to (not including) end as a panel sharing this panel's memory.
+
+        start and end are timestamps (read in tz if naive) or integer row offsets.
+        """
+        start = 0 if start is None else start if isinstance(start, (int, np.integer)) else self.offset(start, tz)
+        end = len(self) if end is None else end if isinstance(end, (int, np.integer)) else self.offset(end, tz)
+        start, end = max(start, 0), min(max(end, 0), len(self))
+        end = max(start, end)
+
+        return HourlyPanel(self.values[start:end], self.columns, self.start_hour + start, self.valid[start:end])
+
+    def split(self, timestamp, tz=LOCAL_TZ):
+        """Returns the panels before and from timestamp, e.g. a train / test split, both sharing this panel's memory"""
+        return self.slice(None, timestamp, tz), self.slice(timestamp, None, tz)
+
+    def save(self, path):
+        """
+        Writes the panel to the directory path as values.npy, valid.npy and panel.json.
+
+        values are stored row-major, so the hours of a window are contiguous on disk and a
+        memory-mapped panel (see load) reads each window as one sequential block.
+        """
+        os.makedirs(path, exist_ok=True)
+
+        values = np.lib.format.open_memmap(os.path.join(path, 'values.npy'), mode='w+', dtype='float32',
+                                           shape=self.values.shape)
+        for start in range(0, len(self), SAVE_CHUNK_ROWS):
+            values[start:start + SAVE_CHUNK_ROWS] = self.values[start:start + SAVE_CHUNK_ROWS]
+        values.flush()
+        del values
+
+        np.save(os.path.join(path, 'valid.npy'), self.valid)
+        with open(os.path.join(path, 'panel.json'), 'w') as f:
+            json.dump({'columns': self.columns, 'start_hour': self.start_hour}, f, indent=1)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """Reads a panel written by save. With the default mmap_mode the values stay on disk and are paged in as they are read"""
+        with open(os.path.join(path, 'panel.json')) as f:
+            meta = json.load(f)
+
+        values = np.load(os.path.join(path, 'values.npy'), mmap_mode=mmap_mode)
+        valid = np.load(os.path.join(path, 'valid.npy'))
+        return cls(values, meta['columns'], meta['start_hour'], valid)
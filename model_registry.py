@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""
+Registry of trained models saved with their features, scalers, training data hash and metrics, so
+predictions and reports can be produced without retraining
+
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+
+
+REGISTRY_PATH = './Model_Registry'
+
+META_FILE = 'meta.json'
+SCALERS_FILE = 'scalers.joblib'
+MODEL_FILES = {'sklearn': 'model.joblib', 'xgboost': 'model.ubj', 'keras': 'model.keras'}
+
+# Tree forests are also saved as flat node arrays, one .npy file each, so they can be memory-mapped
+FOREST_FOLDER = 'forest'
+FOREST_ARRAYS = ['left', 'right', 'feature', 'threshold', 'value', 'roots', 'depth']
+
+
+class RegisteredModel:
+    """
+    A model loaded from the registry.
+
+    Parameters:
+        name (str): Registry name, e.g. 'random_forest'.
+        version (str): Version saved, a UTC timestamp like '20230105T101500'.
+        model (object): The fitted model.
+        features (list): Input columns, in the order the model expects them.
+        scalers (dict): Fitted scalers saved with the model, e.g. {'scaler_X': ..., 'scaler_y': ...}.
+        meta (dict): Everything in meta.json: kind, data_hash, params, metrics and created.
+        forest (dict): Flat node arrays of a tree forest (see forest_arrays), or None.
+    """
+
+    def __init__(self, name, version, model, features, scalers, meta, forest=None):
+        self.name = name
+        self.version = version
+        self.model = model
+        self.features = features
+        self.scalers = scalers
+        self.meta = meta
+        self.forest = forest
+
+
+def data_hash(*data):
+    """Returns a content hash of DataFrames, Series and arrays, covering their values, labels and shapes"""
+    hasher = hashlib.blake2b(digest_size=16)
+    for item in data:
+        if isinstance(item, (pd.DataFrame, pd.Series)):
+            hasher.update(pd.util.hash_pandas_object(item, index=True).to_numpy().tobytes())
+            hasher.update(repr(list(item.columns) if isinstance(item, pd.DataFrame) else item.name).encode())
+        else:
+            array = np.ascontiguousarray(item)
+            hasher.update(f'{array.dtype.str}{array.shape}'.encode())
+            hasher.update(array.view('uint8').reshape(-1) if array.size else b'')
+    return hasher.hexdigest()
+
+
+def _model_kind(model):
+    """Returns 'xgboost', 'keras' or 'sklearn' for how a model is saved"""
+    if hasattr(model, 'get_booster'):
+        return 'xgboost'
+    if type(model).__module__.split('.')[0] in ('keras', 'tensorflow', 'tf_keras'):
+        return 'keras'
+    return 'sklearn'
+
+
+def forest_arrays(forest):
+    """
+    Flattens an averaging tree ensemble (RandomForestRegressor, ExtraTreesRegressor) into concatenated node arrays.
+
+    Child indices are offset into the concatenated arrays and leaves point to themselves, so the
+    trees can be walked together (see forecast_service.FlatForest). Returns None for any other model.
+    """
+    estimators = getattr(forest, 'estimators_', None)
+    if not isinstance(estimators, list) or not estimators or not all(hasattr(e, 'tree_') for e in estimators):
+        return None
+
+    trees = [estimator.tree_ for estimator in estimators]
+    offsets = np.cumsum([0] + [tree.node_count for tree in trees[:-1]])
+
+    return {'left': np.concatenate([np.where(t.children_left < 0, np.arange(t.node_count), t.children_left) + o
+                                    for t, o in zip(trees, offsets)]).astype('int64'),
+            'right': np.concatenate([np.where(t.children_right < 0, np.arange(t.node_count), t.children_right) + o
+                                     for t, o in zip(trees, offsets)]).astype('int64'),
+            'feature': np.concatenate([np.maximum(t.feature, 0) for t in trees]).astype('int64'),
+            'threshold': np.concatenate([t.threshold for t in trees]),
+            'value': np.concatenate([t.value[:, 0, 0] for t in trees]),
+            'roots': offsets.astype('int64'),
+            'depth': np.array(max(t.max_depth for t in trees), dtype='int64')}
+
+
+def save_model(name, model, features, scalers=None, train_data_hash=None, params=None, metrics=None,
+               registry_path=REGISTRY_PATH):
+    """
+    Saves a fitted model as a new version of name and returns the version.
+
+    scikit-learn models are written uncompressed with joblib, XGBoost models in the native binary
+    format and Keras models in the .keras format. Tree forests are also written as the .npy node
+    arrays of forest_arrays, which load_model can memory-map. The version is written to a temporary
+    folder and renamed into place, so a failed save never leaves a partial version behind.
+
+    Parameters:
+        name (str): Registry name, e.g. 'random_forest'.
+        model (object): The fitted model.
+        features (list): Input columns, e.g. endog or rnn_features.
+        scalers (dict): Fitted scalers to keep with the model, e.g. {'scaler_X': scaler_X, 'scaler_y': scaler_y}.
+        train_data_hash (str): data_hash of the training data, used to find a model trained on the same data.
+        params (dict): Hyperparameters, e.g. from the grid search.
+        metrics (dict): Evaluation metrics. Can be added later with update_metrics.
+        registry_path (str): Root folder of the registry.
+
+    Returns:
+        str: The new version.
+    """
+    kind = _model_kind(model)
+    version = time.strftime('%Y%m%dT%H%M%S', time.gmtime())
+    model_path = os.path.join(registry_path, name)
+    while os.path.exists(os.path.join(model_path, version)):
+        time.sleep(1)
+        version = time.strftime('%Y%m%dT%H%M%S', time.gmtime())
+
+    temp_path = os.path.join(model_path, version + '.tmp')
+    os.makedirs(temp_path, exist_ok=True)
+
+    model_file = os.path.join(temp_path, MODEL_FILES[kind])
+    if kind == 'sklearn':
+        joblib.dump(model, model_file)
+
+        arrays = forest_arrays(model)
+        if arrays is not None:
+            os.makedirs(os.path.join(temp_path, FOREST_FOLDER))
+            for key in FOREST_ARRAYS:
+                np.save(os.path.join(temp_path, FOREST_FOLDER, key + '.npy'), arrays[key])
+    elif kind == 'xgboost':
+        model.save_model(model_file)
+    else:
+        model.save(model_file)
+
+    if scalers:
+        joblib.dump(scalers, os.path.join(temp_path, SCALERS_FILE))
+
+    meta = {'name': name,
+            'version': version,
+            'kind': kind,
+            'model_class': type(model).__name__,
+            'features': list(features),
+            'data_hash': train_data_hash,
+            'params': params or {},
+            'metrics': metrics or {},
+            'created': pd.Timestamp.now(tz='UTC').isoformat()}
+    with open(os.path.join(temp_path, META_FILE), 'w') as f:
+        json.dump(meta, f, indent=1, default=str)
+
+    os.replace(temp_path, os.path.join(model_path, version))
+    print(f"Registered {name} version {version}")
+
+    return version
+
+
+def _versions(name, registry_path):
+    """Returns the saved versions of name, oldest first"""
+    model_path = os.path.join(registry_path, name)
+    if not os.path.isdir(model_path):
+        return []
+    return sorted(v for v in os.listdir(model_path)
+                  if not v.endswith('.tmp') and os.path.exists(os.path.join(model_path, v, META_FILE)))
+
+
+def _read_meta(name, version, registry_path):
+    with open(os.path.join(registry_path, name, version, META_FILE)) as f:
+        return json.load(f)
+
+
+def latest_version(name, data_hash=None, registry_path=REGISTRY_PATH):
+    """Returns the newest version of name (trained on data with data_hash, if given), or None if there is none"""
+    for version in reversed(_versions(name, registry_path)):
+        if data_hash is None or _read_meta(name, version, registry_path)['data_hash'] == data_hash:
+            return version
+    return None
+
+
+def load_model(name, version=None, registry_path=REGISTRY_PATH, mmap_mode='r', forest_only=False):
+    """
+    Loads a version of name (the newest by default) as a RegisteredModel.
+
+    The node arrays of a saved forest are loaded with np.load(mmap_mode=mmap_mode) into
+    RegisteredModel.forest, so pages are read on demand and shared between processes. mmap_mode is
+    also passed to joblib.load for scikit-learn models, but the fitted trees copy their nodes into
+    their own buffers on unpickling; with forest_only=True a forest is not unpickled at all and
+    model is None. XGBoost and TensorFlow are only imported when a model of that kind is loaded.
+    """
+    version = version or latest_version(name, registry_path=registry_path)
+    if version is None or not os.path.exists(os.path.join(registry_path, name, version, META_FILE)):
+        raise FileNotFoundError(f"No registered version {version} of {name} in {registry_path}")
+
+    path = os.path.join(registry_path, name, version)
+    meta = _read_meta(name, version, registry_path)
+    model_file = os.path.join(path, MODEL_FILES[meta['kind']])
+
+    forest_path = os.path.join(path, FOREST_FOLDER)
+    forest = {key: np.load(os.path.join(forest_path, key + '.npy'), mmap_mode=mmap_mode)
+              for key in FOREST_ARRAYS} if os.path.isdir(forest_path) else None
+
+    if forest is not None and forest_only:
+        model = None
+    elif meta['kind'] == 'sklearn':
+        model = joblib.load(model_file, mmap_mode=mmap_mode)
+    elif meta['kind'] == 'xgboost':
+        import xgboost
+        model = getattr(xgboost, meta['model_class'])()
+        model.load_model(model_file)
+    else:
+        import tensorflow as tf
+        model = tf.keras.models.load_model(model_file)
+
+    scalers_file = os.path.join(path, SCALERS_FILE)
+    scalers = joblib.load(scalers_file) if os.path.exists(scalers_file) else {}
+
+    return RegisteredModel(name, version, model, meta['features'], scalers, meta, forest)
+
+
+def update_metrics(name, version, metrics, registry_path=REGISTRY_PATH):
+    """Adds metrics (e.g. error_df.loc['Random Forest'].to_dict()) to a saved version"""
+    meta = _read_meta(name, version, registry_path)
+    meta['metrics'].update({key: float(value) for key, value in metrics.items()})
+
+    meta_file = os.path.join(registry_path, name, version, META_FILE)
+    with open(meta_file + '.tmp', 'w') as f:
+        json.dump(meta, f, indent=1, default=str)
+    os.replace(meta_file + '.tmp', meta_file)
+
+
+def list_models(registry_path=REGISTRY_PATH):
+    """Returns a DataFrame with one row per saved version: name, version, model class, data hash, created and metrics"""
+    records = []
+    if os.path.isdir(registry_path):
+        for name in sorted(os.listdir(registry_path)):
+            for version in _versions(name, registry_path):
+                meta = _read_meta(name, version, registry_path)
+                records.append(dict({'name': name, 'version': version, 'model_class': meta['model_class'],
+                                     'data_hash': meta['data_hash'], 'created': meta['created']}, **meta['metrics']))
+    return pd.DataFrame(records)
+
+
+def remove_version(name, version, registry_path=REGISTRY_PATH):
+    """Deletes a saved version of name"""
+    shutil.rmtree(os.path.join(registry_path, name, version))
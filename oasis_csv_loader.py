@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Parallel, schema-typed loader for folders of OASIS csv's (e.g. archives extracted by earlier
+versions of Data_Extraction.py or downloaded by hand from the OASIS site)
+
+Running this file imports every legacy csv folder listed in OASIS_QUERIES into the raw store,
+alongside the downloaded windows and without the days they already cover.
+
+"""
+import glob
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pv
+
+from coverage_manifest import CoverageManifest
+from oasis_downloader import OASIS_QUERIES, get_date_pairs
+from oasis_schema import TIME_COL
+from raw_store import RAW_STORE_PATH, append_window, arrow_schema
+
+
+def read_oasis_csv(file, query_name):
+    """Reads one OASIS csv into an arrow Table, parsing only the schema columns with their final types"""
+    schema = arrow_schema(query_name)
+    convert_options = pv.ConvertOptions(include_columns=schema.names,
+                                        column_types={field.name: field.type for field in schema})
+    return pv.read_csv(file, convert_options=convert_options)
+
+
+def load_oasis_csvs(filepath, query_name, max_workers=None):
+    """
+    Loads every csv in the folder filepath into a single DataFrame sorted by INTERVALSTARTTIME_GMT.
+
+    Replaces create_mult_csv_df. Files are parsed concurrently by the pyarrow csv engine (which
+    releases the GIL), reading only the columns in the query's schema with explicit dtypes. The
+    per-file tables are concatenated once without copying before conversion to pandas.
+
+    Parameters:
+        filepath (str): Folder containing the csv's.
+        query_name (str): OASIS query the csv's belong to. Selects the columns and dtypes.
+        max_workers (int): Number of files parsed at once. Defaults to the ThreadPoolExecutor default.
+
+    Returns:
+        DataFrame: Rows from all files with categorical labels, float32 values and UTC timestamps.
+    """
+    files = sorted(glob.glob(os.path.join(filepath, '*csv')))
+    if not files:
+        raise FileNotFoundError("No csv files found in " + filepath)
+
+    start_time = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        tables = list(executor.map(lambda file: read_oasis_csv(file, query_name), files))
+
+    table = pa.concat_tables(tables)
+    table = table.sort_by(TIME_COL)
+    df = table.to_pandas()
+
+    # Report ingestion speed so it can be tracked as the archive grows
+    elapsed = time.perf_counter() - start_time
+    megabytes = sum(os.path.getsize(file) for file in files) / 1e6
+    print(f"Loaded {len(df):,} rows from {len(files)} files ({megabytes:,.1f} MB) in {elapsed:.2f}s: "
+          f"{len(df) / elapsed:,.0f} rows/s, {megabytes / elapsed:,.1f} MB/s")
+
+    return df
+
+
+def import_oasis_csvs(filepath, query_name, manifest, store_path=RAW_STORE_PATH):
+    """
+    Appends the rows of a folder of OASIS csv's to the raw store and records their days in the manifest.
+
+    Days the manifest already covers are skipped, so nothing that was downloaded is duplicated or
+    deleted. The remaining days are written with append_window in the same windows that
+    get_date_pairs would download them in, and each window is recorded once it is on disk, so
+    Data_Extraction.py only requests the days the csv's do not have.
+
+    Parameters:
+        filepath (str): Folder containing the csv's.
+        query_name (str): OASIS query the csv's belong to.
+        manifest (CoverageManifest): Manifest of the windows already in the store.
+        store_path (str): Root folder of the raw store.
+
+    Returns:
+        int: Number of rows written.
+    """
+    df = load_oasis_csvs(filepath, query_name)
+    node = OASIS_QUERIES[query_name]['node']
+
+    # OASIS days start at 00:00 PST (08:00 UTC), as in build_query_url
+    days = (df[TIME_COL] - pd.Timedelta(hours=8)).dt.tz_localize(None).dt.normalize()
+    new = ~days.isin(manifest.covered_days(query_name, node))
+    df, days = df[new], days[new]
+    if df.empty:
+        return 0
+
+    # Days without rows count as covered here, so that windows split at the csv's gaps
+    all_days = pd.date_range(days.min(), days.max(), freq='D')
+    date_pairs = get_date_pairs(days.min(), days.max(), covered_days=all_days[~all_days.isin(days)])
+
+    rows = 0
+    for start, end in date_pairs:
+        in_window = (days >= pd.Timestamp(start)) & (days < pd.Timestamp(end))
+        rows += append_window(query_name, start, end, [df[in_window]], store_path)
+        manifest.record(query_name, node, start, end)
+
+    return rows
+
+
+if __name__ == '__main__':
+    manifest = CoverageManifest()
+    for query_name, query in OASIS_QUERIES.items():
+        if os.path.isdir(query['folder']):
+            import_oasis_csvs(query['folder'], query_name, manifest)
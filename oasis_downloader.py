@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+Concurrent, rate-limited downloader for CAISO OASIS SingleZip queries
+
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+
+# CAISO asks OASIS clients to leave roughly 5 seconds between requests and answers with
+# HTTP 429 when that budget is exceeded. The limiter below enforces this across all threads
+OASIS_REQUESTS_PER_SECOND = 1 / 5
+OASIS_BURST = 1
+
+# Number of requests kept in flight. OASIS takes several seconds to build each zip, so
+# overlapping requests lets the crawl run at the rate limit instead of at the response time
+MAX_WORKERS = 4
+
+OASIS_BASE_URL = 'http://oasis.caiso.com/oasisapi/SingleZip'
+
+# Query parameters, pricing node and raw data folder for each OASIS report used in this project.
+# Queries that are not node-specific have node set to None
+OASIS_QUERIES = {
+    'PRC_INTVL_LMP': {'params': 'resultformat=6&queryname=PRC_INTVL_LMP&version=3&market_run_id=RTM',
+                      'node': 'PACFCBCH_6_N004',
+                      'folder': 'Raw_Data/PACFCBCH_Interval_LMP'},
+    'PRC_LMP': {'params': 'resultformat=6&queryname=PRC_LMP&version=12&market_run_id=DAM',
+                'node': 'PACFCBCH_6_N004',
+                'folder': 'Raw_Data/PACFCBCH_DA_LMP'},
+    'ENE_SLRS': {'params': 'resultformat=6&queryname=ENE_SLRS&version=1&market_run_id=RTM&tac_zone_name=ALL&schedule=Export,Generation,Import,Load',
+                 'node': None,
+                 'folder': 'Raw_Data/CAISO_LOAD'},
+    'SLD_REN_FCST': {'params': 'resultformat=6&queryname=SLD_REN_FCST&version=1',
+                     'node': None,
+                     'folder': 'Raw_Data/Wind_Solar_Forecast'},
+}
+
+
+# Get Date Ranges for each month in dataset
+# CAISO API allows for 15 day limits. Therefore, generate half-open windows of at most 14 days
+
+def get_date_pairs(start_date, end_date, covered_days=None, window_days=14):
+    """
+    Generates half-open date windows of at most window_days days covering start_date to end_date (inclusive).
+
+    Each pair is requested from OASIS as [start 00:00 PST, end 00:00 PST), so a pair's end date
+    is the first day it does not cover, consecutive pairs share a boundary date and the final
+    pair ends the day after end_date.
+
+    Parameters:
+        start_date (str): Start date in the format 'YYYY-MM-DD'.
+        end_date (str): End date in the format 'YYYY-MM-DD'.
+        covered_days (DatetimeIndex): Days already on disk (see CoverageManifest.covered_days).
+            Only the remaining days are planned, split into windows at every covered gap.
+        window_days (int): Maximum number of days in a single request.
+
+    Returns:
+        list of tuples: List of date pairs in the format (start_date, end_date).
+    """
+    days = pd.date_range(start_date, end_date, freq='D')
+    if covered_days is not None:
+        days = days[~days.isin(covered_days)]
+
+    date_pairs = []
+    window_start = window_end = None
+
+    for day in days:
+        # Start a new window after a gap of covered days or once the current window is full
+        if window_start is None or day != window_end or (day - window_start).days >= window_days:
+            if window_start is not None:
+                date_pairs.append((window_start.strftime('%Y%m%d'), window_end.strftime('%Y%m%d')))
+            window_start = day
+        window_end = day + pd.Timedelta(days=1)
+
+    if window_start is not None:
+        date_pairs.append((window_start.strftime('%Y%m%d'), window_end.strftime('%Y%m%d')))
+
+    return date_pairs
+
+
+def build_query_url(query_name, start, end):
+    """Returns the SingleZip url for query_name between start and end (dates formatted as 'YYYYMMDD')"""
+    query = OASIS_QUERIES[query_name]
+    params = query['params'] if query['node'] is None else query['params'] + '&node=' + query['node']
+    return f'{OASIS_BASE_URL}?{params}&startdatetime={start}T08:00-0000&enddatetime={end}T08:00-0000'
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket used to keep the crawl within the OASIS request budget.
+
+    Parameters:
+        rate (float): Tokens added per second.
+        capacity (int): Maximum number of tokens that can be saved up for a burst.
+    """
+
+    def __init__(self, rate=OASIS_REQUESTS_PER_SECOND, capacity=OASIS_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a token is available and then consumes it"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+                self._last_refill = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                wait = (1 - self._tokens) / self.rate
+
+            time.sleep(wait)
+
+
+def create_session(max_workers=MAX_WORKERS):
+    """Returns a requests Session whose connection pool keeps one keep-alive connection per worker"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def fetch(session, url, limiter, tries=3):
+    """
+    Requests url once a token is available from limiter, retrying on connection errors and HTTP 429.
+
+    Returns:
+        requests.Response: Successful (status 200) response with the body not yet consumed.
+    """
+    for attempt in range(1, tries + 1):
+        limiter.acquire()
+
+        try:
+            r = session.get(url, stream=True, timeout=(10, 300))
+        except requests.exceptions.RequestException as ex:
+            if attempt == tries:
+                raise
+            print("Retrying " + url + "\n" + str(ex))
+            continue
+
+        if r.status_code == 429 and attempt < tries:
+            # Rate limit hit (e.g. by another client on the same IP). The limiter already spaces
+            # requests out, so simply wait for the next token
+            r.close()
+            continue
+
+        r.raise_for_status()
+        return r
+
+
+def download_windows(jobs, handle_response, max_workers=MAX_WORKERS, limiter=None, session=None):
+    """
+    Downloads OASIS query windows concurrently while respecting the request budget.
+
+    Parameters:
+        jobs (list of tuples): (query_name, start, end) windows to download. Dates formatted as 'YYYYMMDD'.
+        handle_response (callable): Called as handle_response(query_name, start, end, response) from the
+            worker thread for every successful download.
+        max_workers (int): Number of requests kept in flight.
+        limiter (TokenBucket): Shared rate limiter. Defaults to the OASIS request budget.
+        session (requests.Session): Session to reuse. Defaults to a new pooled session.
+
+    Returns:
+        list of tuples: Jobs that failed after all retries.
+    """
+    limiter = limiter or TokenBucket()
+    session = session or create_session(max_workers)
+    failed = []
+
+    def run_job(job):
+        query_name, start, end = job
+        r = fetch(session, build_query_url(query_name, start, end), limiter)
+        with r:
+            handle_response(query_name, start, end, r)
+
+    start_time = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(run_job, job): job for job in jobs}
+
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                future.result()
+            except Exception as ex:
+                print("Failed to retrieve: " + build_query_url(*job) + "\n" + str(ex))
+                failed.append(job)
+
+    elapsed = time.monotonic() - start_time
+    print(f"Downloaded {len(jobs) - len(failed)} of {len(jobs)} windows in {elapsed:.0f}s")
+
+    return failed
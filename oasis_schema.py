@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""
+Columns and dtypes kept from each OASIS report
+
+"""
+
+# Every OASIS report is keyed by the GMT start of its interval
+TIME_COL = 'INTERVALSTARTTIME_GMT'
+
+# Low-cardinality label columns are stored as categoricals and measurements as float32
+OASIS_SCHEMAS = {
+    'PRC_INTVL_LMP': {'categories': ['NODE', 'LMP_TYPE'], 'values': ['VALUE']},
+    'PRC_LMP': {'categories': ['NODE', 'LMP_TYPE'], 'values': ['MW']},
+    'ENE_SLRS': {'categories': ['TAC_ZONE_NAME', 'SCHEDULE'], 'values': ['MW']},
+    'SLD_REN_FCST': {'categories': ['TRADING_HUB', 'RENEWABLE_TYPE', 'LABEL'], 'values': ['MW']},
+}
+
+
+def usecols(query_name):
+    """Returns the list of csv columns read for query_name"""
+    schema = OASIS_SCHEMAS[query_name]
+    return [TIME_COL] + schema['categories'] + schema['values']
+
+
+def csv_dtypes(query_name):
+    """Returns the read_csv dtype mapping for query_name. The time column is parsed separately"""
+    schema = OASIS_SCHEMAS[query_name]
+    dtypes = {col: 'category' for col in schema['categories']}
+    dtypes.update({col: 'float32' for col in schema['values']})
+    return dtypes
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+Streams the csv files inside an OASIS SingleZip response straight into typed DataFrame chunks
+
+"""
+import io
+import struct
+import zlib
+
+import pandas as pd
+
+from oasis_schema import TIME_COL, usecols, csv_dtypes
+
+
+LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+LOCAL_HEADER = struct.Struct('<4sHHHHHIIIHH')
+
+# Optional signature of the data descriptor that follows a member whose sizes were not in its header
+DATA_DESCRIPTOR_SIGNATURE = b'PK\x07\x08'
+DATA_DESCRIPTOR = struct.Struct('<III')
+
+# Rows parsed per chunk. Caps the memory used per response regardless of window length
+CHUNK_ROWS = 200_000
+
+
+class _ArchiveBytes:
+    """Archive bytes as they arrive, keeping bytes read ahead of the current member for the next read"""
+
+    def __init__(self, byte_chunks):
+        self.chunks = iter(byte_chunks)
+        self.buffer = b''
+
+    def _next_chunk(self):
+        """Returns the next non-empty chunk, or None at the end of the archive"""
+        for chunk in self.chunks:
+            if chunk:
+                return chunk
+        return None
+
+    def read(self):
+        """Returns the buffered bytes, or the next chunk if there are none (None at the end)"""
+        if self.buffer:
+            data, self.buffer = self.buffer, b''
+            return data
+        return self._next_chunk()
+
+    def read_exactly(self, n, what):
+        while len(self.buffer) < n:
+            chunk = self._next_chunk()
+            if chunk is None:
+                raise ValueError(f"Zip archive ended before {what} was complete")
+            self.buffer += chunk
+        data, self.buffer = self.buffer[:n], self.buffer[n:]
+        return data
+
+    def peek(self, n):
+        """Returns up to the next n bytes without consuming them"""
+        while len(self.buffer) < n:
+            chunk = self._next_chunk()
+            if chunk is None:
+                break
+            self.buffer += chunk
+        return self.buffer[:n]
+
+
+def _member_data(archive, name, flags, method, crc, compressed_size):
+    """Yields the decompressed bytes of the member whose local header was just read, leaving archive at the next header"""
+    # Sizes and crc are only in the header when bit 3 of flags is not set
+    sizes_known = not flags & 0x08
+    running_crc = 0
+
+    if method == 0:
+        if not sizes_known:
+            raise ValueError("Cannot stream a stored zip member without its size")
+        remaining = compressed_size
+        while remaining > 0:
+            data = archive.read()
+            if data is None:
+                raise ValueError("Zip archive ended before " + name + " was complete")
+            archive.buffer, data = data[remaining:], data[:remaining]
+            remaining -= len(data)
+            running_crc = zlib.crc32(data, running_crc)
+            yield data
+
+    elif method == 8:
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        while not decompressor.eof:
+            data = archive.read()
+            if data is None:
+                raise ValueError("Zip archive ended before " + name + " was complete")
+            out = decompressor.decompress(data)
+            running_crc = zlib.crc32(out, running_crc)
+            yield out
+        # Bytes past the end of the deflate stream belong to what follows the member
+        archive.buffer = decompressor.unused_data + archive.buffer
+
+    else:
+        raise ValueError(f"Unsupported zip compression method {method} for {name}")
+
+    if not sizes_known:
+        if archive.peek(4) == DATA_DESCRIPTOR_SIGNATURE:
+            archive.read_exactly(4, "the data descriptor of " + name)
+        crc = DATA_DESCRIPTOR.unpack(archive.read_exactly(DATA_DESCRIPTOR.size, "the data descriptor of " + name))[0]
+
+    if running_crc != crc:
+        raise ValueError("CRC check failed for " + name)
+
+
+def iter_zip_members(byte_chunks):
+    """
+    Decompresses every member of a zip archive in order while its bytes are still arriving.
+
+    The local file header before each member has everything needed to inflate it, so there is
+    no need to wait for the central directory at the end of the archive. A member's data must
+    be read before moving to the next member (any data left unread is skipped).
+
+    Parameters:
+        byte_chunks (iterable of bytes): Raw archive bytes, e.g. response.iter_content().
+
+    Yields:
+        (str, iterator of bytes): Name and decompressed contents of each member.
+    """
+    archive = _ArchiveBytes(byte_chunks)
+
+    if archive.peek(4) != LOCAL_HEADER_SIGNATURE:
+        raise ValueError("Response is not a zip archive")
+
+    # Members end where the central directory (or anything other than another local header) starts
+    while archive.peek(4) == LOCAL_HEADER_SIGNATURE:
+        header = archive.read_exactly(LOCAL_HEADER.size, "the member header")
+        (_, _, flags, method, _, _, crc, compressed_size, _, name_len, extra_len) = LOCAL_HEADER.unpack(header)
+        name = archive.read_exactly(name_len, "the member header").decode('utf-8', errors='replace')
+        archive.read_exactly(extra_len, "the member header")
+
+        data = _member_data(archive, name, flags, method, crc, compressed_size)
+        yield name, data
+        for _ in data:
+            pass
+
+
+class IterStream(io.RawIOBase):
+    """Read-only file object over an iterator of bytes, so read_csv can consume a stream"""
+
+    def __init__(self, byte_iter):
+        self._iter = byte_iter
+        self._leftover = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._leftover:
+            self._leftover = next(self._iter, None)
+            if self._leftover is None:
+                self._leftover = b''
+                return 0
+
+        n = min(len(b), len(self._leftover))
+        b[:n] = self._leftover[:n]
+        self._leftover = self._leftover[n:]
+        return n
+
+
+def read_oasis_zip(byte_chunks, query_name, chunksize=CHUNK_ROWS):
+    """
+    Parses every csv in an OASIS zip into typed DataFrame chunks without writing it to disk.
+
+    Members are parsed one after the other as the archive streams in, so a response split over
+    several csv files is read in full. OASIS returns an xml error report inside the zip when a
+    request is rejected, so any member that is not a csv raises a ValueError.
+
+    Parameters:
+        byte_chunks (iterable of bytes): Raw archive bytes.
+        query_name (str): OASIS query the archive belongs to. Selects the columns and dtypes kept.
+        chunksize (int): Number of rows per yielded DataFrame.
+
+    Yields:
+        DataFrame: Chunk with a UTC datetime INTERVALSTARTTIME_GMT, categorical labels and float32 values.
+    """
+    for name, data in iter_zip_members(byte_chunks):
+        if not name.lower().endswith('.csv'):
+            raise ValueError("Zip member is not a csv: " + name)
+
+        stream = io.BufferedReader(IterStream(data), buffer_size=1 << 20)
+        reader = pd.read_csv(stream,
+                             usecols=usecols(query_name),
+                             dtype=csv_dtypes(query_name),
+                             chunksize=chunksize)
+
+        with reader:
+            for chunk in reader:
+                chunk[TIME_COL] = pd.to_datetime(chunk[TIME_COL], utc=True)
+                yield chunk
+
+
+def read_oasis_response(r, query_name, chunksize=CHUNK_ROWS):
+    """Parses a streamed (stream=True) OASIS response into typed DataFrame chunks. See read_oasis_zip"""
+    return read_oasis_zip(r.iter_content(chunk_size=1 << 16), query_name, chunksize)
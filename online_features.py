@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""
+Online computation of the hourly feature table, one new hour at a time, from fixed-size ring buffers
+
+Run with an optional start and end (UTC) to check on the raw store that the online features match
+add_features bit for bit, e.g. python online_features.py 2023-01-01 2023-03-01
+
+Registered models use the column names of Models-LMP_Forecast.ipynb, so the rows are passed on to
+the forecast service as dict(zip(engine.model_columns, features)).
+
+"""
+import sys
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import numpy as np
+import pandas as pd
+
+from DataCleaning import (LAG_SHIFTS, TARGET_SHIFTS, SPIKE_THRESHOLDS, ROLLING_SPIKE_VARS, lag_var_list,
+                          add_features, add_renewable_totals, format_column_names, load_sources, merge_sources)
+from feature_engineering import calendar_features
+from hourly_panel import HOUR_NS, LOCAL_TZ
+from rolling_features import ROLLING_WINDOWS, OnlineBlockScan, _scan_channels, _window_statistics, _window_feature_names
+
+
+CALENDAR_COLS = ['friday', 'weekend', 'hour', 'on_peak_hour', 'month']
+CYCLICAL_COLS = ['sin_month', 'cos_month', 'sin_hour', 'cos_hour']
+
+# Replacements the models notebook applies to the feature table's column names, in order
+MODEL_NAME_REPLACEMENTS = [('LMP', 'locational_marginal_price'), ('MCC', 'marginal_congestion_component'),
+                           ('MCE', 'marginal_energy_component'), ('MCL', 'marginal_loss_component'),
+                           ('MGHG', 'marginal_greenhouse_gas_component')]
+
+# Targets of future prices are unknown when an hour arrives, so the engine leaves them NaN
+VALUE_TARGETS = [name for name, (source, _) in TARGET_SHIFTS.items() if source not in CALENDAR_COLS + CYCLICAL_COLS]
+
+
+def model_column_names(columns):
+    """Returns feature table column names as the models notebook renames them, e.g. RT_LMP -> RT_locational_marginal_price"""
+    for old, new in MODEL_NAME_REPLACEMENTS:
+        columns = [col.replace(old, new) for col in columns]
+    return columns
+
+
+def _calendar_tables():
+    """
+    Returns the calendar features by local hour of day and by month, taken from calendar_features itself.
+
+    Returns
+    -------
+    by_hour : ndarray of shape (24, 4)
+        hour, on_peak_hour, sin_hour and cos_hour.
+    by_month : ndarray of shape (13, 3)
+        month, sin_month and cos_month (row 0 unused).
+    """
+    calendar_df = calendar_features(pd.date_range('2021-01-01', periods=24 * 365, freq='h', tz=LOCAL_TZ))
+    by_hour = calendar_df.groupby('hour')[['hour', 'on_peak_hour', 'sin_hour', 'cos_hour']].first()
+    by_month = calendar_df.groupby('month')[['month', 'sin_month', 'cos_month']].first()
+
+    by_month_table = np.full((13, 3), np.nan)
+    by_month_table[by_month.index] = by_month.to_numpy(dtype='float64')
+    return by_hour.to_numpy(dtype='float64'), by_month_table
+
+
+class OnlineFeatureEngine:
+    """
+    Builds the feature row of add_features for each new hour of merged source data as it arrives.
+
+    Lag sources of the latest hours are kept in a ring buffer (row hour % size holds that hour)
+    and each rolling window in the fixed-size block state of an OnlineBlockScan, so an update
+    writes one row and reads fixed positions, with no reallocation and a cost that does not grow
+    with history. Hours skipped between updates are cleared to NaN, so gaps behave as missing
+    hours do in the batch features.
+
+    Rolling statistics are scanned in the same order as the batch block scans, and lags, spike
+    flags, renewable totals and calendar features use the same definitions and dtypes as
+    add_features, so every feature matches the batch table bit for bit (see check_parity). As in
+    the batch, a row's rolling features only see hours since the first update, so feed at least
+    MAX_LAG_HOURS of history before relying on them.
+
+    columns holds the feature names of add_features and model_columns the same names as the
+    models notebook renames them, which are the names registered models expect.
+
+    Targets of future prices (VALUE_TARGETS) are NaN, and calendar targets are those of the hour
+    they look ahead to whether or not it later arrives (the batch leaves them NaN until it does).
+
+    Parameters:
+        source_columns (list): Columns of the merged hourly data (merge_sources), in order.
+    """
+
+    def __init__(self, source_columns):
+        self.source_columns = list(source_columns)
+        self.size = -min(shift for _, shift in LAG_SHIFTS.values()) + 1
+        self.buffer_columns = list(dict.fromkeys(source for source, _ in LAG_SHIFTS.values()))
+        self.values = np.full((self.size, len(self.buffer_columns)), np.nan)
+        self.last_hour = None
+
+        self.lag_shifts = np.array([shift for _, shift in LAG_SHIFTS.values()])
+        self.lag_positions = np.array([self.buffer_columns.index(source) for source, _ in LAG_SHIFTS.values()])
+        self.spike_positions = [lag_var_list.index(col) for col in ROLLING_SPIKE_VARS]
+        widths = {key: channel.shape[1] for key, channel in
+                  _scan_channels(np.zeros((1, len(lag_var_list))), self.spike_positions, SPIKE_THRESHOLDS).items()}
+        self.scans = [{key: OnlineBlockScan(window, 1 - 2.0 / (window + 1) if key == 'decay' else key, width)
+                       for key, width in widths.items()}
+                      for window in ROLLING_WINDOWS]
+        self.by_hour, self.by_month = _calendar_tables()
+        self.timezone = ZoneInfo(LOCAL_TZ)
+        self.calendar_targets = [source_shift for name, source_shift in TARGET_SHIFTS.items() if name not in VALUE_TARGETS]
+
+        # Renewable totals are added by add_renewable_totals itself, on one row of float32 scalars
+        self.total_columns = list(add_renewable_totals({col: np.float32(0) for col in self.source_columns}))[
+            len(self.source_columns):]
+        self.rolling_columns = [name for window in ROLLING_WINDOWS
+                                for name in _window_feature_names(lag_var_list, window, ROLLING_SPIKE_VARS,
+                                                                  SPIKE_THRESHOLDS, 'hr')]
+        spike_cols = ['RTLMP_spike_' + str(threshold) + '_binary' for threshold in SPIKE_THRESHOLDS]
+
+        # Same column order as add_features
+        self.columns = format_column_names(self.source_columns + spike_cols + CALENDAR_COLS + self.total_columns
+                                           + list(LAG_SHIFTS) + self.rolling_columns + CYCLICAL_COLS
+                                           + list(TARGET_SHIFTS))
+        self.model_columns = model_column_names(self.columns)
+        target_start = len(self.columns) - len(TARGET_SHIFTS)
+        self.value_target_positions = [target_start + i for i, name in enumerate(TARGET_SHIFTS) if name in VALUE_TARGETS]
+        self.calendar_target_positions = [target_start + i for i, name in enumerate(TARGET_SHIFTS)
+                                          if name not in VALUE_TARGETS]
+
+    def _calendar(self, hour):
+        """Returns the calendar and cyclical features of an epoch hour as a dict"""
+        local = datetime.fromtimestamp(hour * 3600, self.timezone)
+        hour_row, month_row = self.by_hour[local.hour], self.by_month[local.month]
+        return {'friday': float(local.weekday() == 4), 'weekend': float(local.weekday() > 4),
+                'hour': hour_row[0], 'on_peak_hour': hour_row[1], 'month': month_row[0],
+                'sin_month': month_row[1], 'cos_month': month_row[2], 'sin_hour': hour_row[2], 'cos_hour': hour_row[3]}
+
+    def _rolling(self, hour, values):
+        """Adds the rolling inputs of hour to the window scans and returns its rolling features, in rolling_columns order"""
+        channels = _scan_channels(values[None], self.spike_positions, SPIKE_THRESHOLDS)
+        reduced = [{key: scan.update(hour, channels[key][0]) for key, scan in scans.items()} for scans in self.scans]
+
+        # The statistics are computed row by row, so all windows go through _window_statistics at once
+        stats, spike_counts = _window_statistics({key: np.array([scans[key] for scans in reduced]) for key in channels},
+                                                 len(lag_var_list))
+        return np.concatenate([stats.reshape(len(ROLLING_WINDOWS), -1), spike_counts], axis=1).astype('float32').ravel()
+
+    def update(self, timestamp, values):
+        """
+        Adds the merged source data of a new hour and returns its feature row.
+
+        Parameters:
+            timestamp (Timestamp): Start of the hour, tz-aware (read in LOCAL_TZ if not). Must be
+                later than the previous update.
+            values (dict or array): Source values by column, or in source_columns order.
+
+        Returns:
+            ndarray: float64 features in columns order.
+        """
+        timestamp = pd.Timestamp(timestamp)
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.tz_localize(LOCAL_TZ)
+        hour = int(timestamp.value // HOUR_NS)
+        if self.last_hour is not None and hour <= self.last_hour:
+            raise ValueError(f"Hour {timestamp} is not after the last hour added")
+
+        if isinstance(values, dict):
+            values = [values[col] for col in self.source_columns]
+        row = np.asarray(values, dtype='float32').reshape(len(self.source_columns))
+        sources = dict(zip(self.source_columns, row))
+        totals = add_renewable_totals(dict(sources))
+
+        # Clear the hours skipped since the last update, then store this one
+        if self.last_hour is not None:
+            for skipped in range(max(self.last_hour + 1, hour - self.size + 1), hour):
+                self.values[skipped % self.size] = np.nan
+        self.last_hour = hour
+        self.values[hour % self.size] = [totals[col] for col in self.buffer_columns]
+
+        calendar = self._calendar(hour)
+        ahead = {shift: self._calendar(hour + shift) for shift in {shift for _, shift in self.calendar_targets}}
+        targets = [ahead[shift][source] for source, shift in self.calendar_targets]
+        rt_lmp = float(sources['RT_LMP'])
+
+        features = np.concatenate([row,
+                                   [float(rt_lmp >= threshold) for threshold in SPIKE_THRESHOLDS],
+                                   [calendar[col] for col in CALENDAR_COLS],
+                                   [totals[col] for col in self.total_columns],
+                                   self.values[(hour + self.lag_shifts) % self.size, self.lag_positions],
+                                   self._rolling(hour, np.array([totals[col] for col in lag_var_list], dtype='float64')),
+                                   [calendar[col] for col in CYCLICAL_COLS],
+                                   np.full(len(TARGET_SHIFTS), np.nan)])
+        features[self.calendar_target_positions] = targets
+        return features
+
+
+def _same_bits(online, batch):
+    """Returns where two float64 arrays are bitwise equal, counting any two NaNs as equal"""
+    return (online.view('uint64') == batch.view('uint64')) | (np.isnan(online) & np.isnan(batch))
+
+
+def check_parity(df, n_gaps=24, seed=0):
+    """
+    Feeds merged hourly data through OnlineFeatureEngine one hour at a time and compares every row with add_features.
+
+    n_gaps random hours are dropped first, so that the comparison covers gaps. Features must be
+    bitwise equal (any NaN equals any NaN), except that VALUE_TARGETS are skipped and calendar
+    targets are only compared where the batch has the target hour.
+
+    Parameters:
+        df (DataFrame): Merged hourly data, as returned by merge_sources.
+        n_gaps (int): Hours to drop before the comparison.
+        seed (int): Seed of the dropped hours.
+
+    Returns:
+        Series: Rows that differ per feature, for the features with any.
+    """
+    rng = np.random.default_rng(seed)
+    df = df.drop(df.index[rng.choice(len(df), min(n_gaps, len(df)), replace=False)])
+    batch = add_features(df.copy())
+
+    engine = OnlineFeatureEngine(df.columns)
+    rows = df.to_numpy(dtype='float32')
+    start = time.perf_counter()
+    online = np.stack([engine.update(timestamp, row) for timestamp, row in zip(df.index, rows)])
+    seconds = time.perf_counter() - start
+
+    expected = batch[engine.columns].to_numpy(dtype='float64')
+    same = _same_bits(online, expected)
+    same[:, engine.value_target_positions] = True
+    same[:, engine.calendar_target_positions] |= np.isnan(expected[:, engine.calendar_target_positions])
+
+    mismatches = pd.Series((~same).sum(axis=0), index=engine.columns)
+    mismatches = mismatches[mismatches > 0]
+    print(f"{len(df)} hours x {len(engine.columns)} features: "
+          f"{'bit for bit identical' if mismatches.empty else f'{len(mismatches)} features differ'}, "
+          f"{seconds / len(df) * 1e6:.0f} us per hour")
+
+    return mismatches
+
+
+if __name__ == '__main__':
+    start, end = (sys.argv[1:3] + [None, None])[:2]
+    differing = check_parity(merge_sources(load_sources(start, end)))
+    if not differing.empty:
+        print(differing.to_string())
+        sys.exit(1)
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Month-partitioned Parquet store for raw OASIS and weather data
+
+"""
+import operator
+import os
+import shutil
+from functools import reduce
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from oasis_schema import OASIS_SCHEMAS, TIME_COL
+
+
+RAW_STORE_PATH = 'Raw_Data/store'
+
+# Every dataset in the store. Weather data is keyed by the same UTC time column as the OASIS reports
+STORE_SCHEMAS = dict(OASIS_SCHEMAS, WEATHER={'categories': [], 'values': ['temperature_2m']})
+
+# Files are partitioned by the UTC month of TIME_COL, e.g. PRC_LMP/month=2021-03/20210301_20210315.parquet
+PARTITIONING = ds.partitioning(pa.schema([('month', pa.string())]), flavor='hive')
+
+
+def arrow_schema(dataset_name):
+    """Returns the arrow schema that every file for dataset_name is written with"""
+    schema = STORE_SCHEMAS[dataset_name]
+    fields = [pa.field(TIME_COL, pa.timestamp('ns', tz='UTC'))]
+    fields += [pa.field(col, pa.dictionary(pa.int32(), pa.string())) for col in schema['categories']]
+    fields += [pa.field(col, pa.float32()) for col in schema['values']]
+    return pa.schema(fields)
+
+
+def append_window(dataset_name, start, end, chunks, store_path=RAW_STORE_PATH):
+    """
+    Writes the DataFrame chunks of one downloaded window to the store, one row group per chunk and month.
+
+    Each month the window touches gets its own file. Files are written under a hidden temporary name
+    (ignored by open_dataset) and renamed once the whole window is complete, so readers never see a
+    partially written window and a re-downloaded window replaces the old one.
+
+    Returns:
+        int: Number of rows written.
+    """
+    schema = arrow_schema(dataset_name)
+    file_name = f'{start}_{end}.parquet'
+    writers = {}
+    rows = 0
+
+    try:
+        for chunk in chunks:
+            months = chunk[TIME_COL].dt.strftime('%Y-%m')
+
+            for month, part in chunk.groupby(months, sort=False):
+                if month not in writers:
+                    folder = os.path.join(store_path, dataset_name, 'month=' + month)
+                    os.makedirs(folder, exist_ok=True)
+                    writers[month] = pq.ParquetWriter(os.path.join(folder, '.' + file_name), schema)
+
+                writers[month].write_table(pa.Table.from_pandas(part, schema=schema, preserve_index=False))
+
+            rows += len(chunk)
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    for month in writers:
+        folder = os.path.join(store_path, dataset_name, 'month=' + month)
+        os.replace(os.path.join(folder, '.' + file_name), os.path.join(folder, file_name))
+
+    return rows
+
+
+def write_dataset(dataset_name, df, store_path=RAW_STORE_PATH):
+    """Replaces everything stored for dataset_name with df. Used for sources that are always downloaded in full"""
+    shutil.rmtree(os.path.join(store_path, dataset_name), ignore_errors=True)
+    return append_window(dataset_name, 'full', 'full', [df], store_path)
+
+
+def open_dataset(dataset_name, store_path=RAW_STORE_PATH):
+    """Returns a pyarrow Dataset over every stored file for dataset_name"""
+    return ds.dataset(os.path.join(store_path, dataset_name),
+                      schema=arrow_schema(dataset_name).append(pa.field('month', pa.string())),
+                      format='parquet',
+                      partitioning=PARTITIONING)
+
+
+def partition_files(dataset_name, start=None, end=None, store_path=RAW_STORE_PATH):
+    """Returns the sorted paths of the stored files for dataset_name in the months overlapping [start, end)"""
+    folder = os.path.join(store_path, dataset_name)
+    first_month = to_utc(start).strftime('%Y-%m') if start is not None else ''
+    last_month = to_utc(end).strftime('%Y-%m') if end is not None else '9999-99'
+
+    files = []
+    for partition in sorted(os.listdir(folder)):
+        month = partition.split('=')[-1]
+        if partition.startswith('month=') and first_month <= month <= last_month:
+            files += [os.path.join(folder, partition, f) for f in sorted(os.listdir(os.path.join(folder, partition)))
+                      if f.endswith('.parquet') and not f.startswith('.')]
+
+    return files
+
+
+def build_filter(start=None, end=None, where=None, partitioned=False):
+    """
+    Returns the pyarrow filter expression for read_query's start / end / where arguments, or None.
+
+    With partitioned=True the month partition column is bounded as well, so whole months are pruned
+    before the time bounds prune row groups by their statistics.
+    """
+    filters = []
+
+    if start is not None:
+        start = to_utc(start)
+        filters.append(ds.field(TIME_COL) >= start)
+        if partitioned:
+            filters.append(ds.field('month') >= start.strftime('%Y-%m'))
+    if end is not None:
+        end = to_utc(end)
+        filters.append(ds.field(TIME_COL) < end)
+        if partitioned:
+            filters.append(ds.field('month') <= end.strftime('%Y-%m'))
+    for col, values in (where or {}).items():
+        filters.append(ds.field(col).isin(values))
+
+    return reduce(operator.and_, filters) if filters else None
+
+
+def read_query(dataset_name, columns=None, start=None, end=None, where=None, store_path=RAW_STORE_PATH):
+    """
+    Reads stored rows for dataset_name, touching only the requested columns, months and row groups.
+
+    Parameters:
+        dataset_name (str): OASIS query name or 'WEATHER'.
+        columns (list): Columns to return. Defaults to every column in the schema.
+        start (str or Timestamp): Inclusive lower bound on INTERVALSTARTTIME_GMT (UTC if naive).
+        end (str or Timestamp): Exclusive upper bound on INTERVALSTARTTIME_GMT (UTC if naive).
+        where (dict): Column name -> list of values to keep, e.g. {'TAC_ZONE_NAME': ['Caiso_Totals']}.
+
+    Returns:
+        DataFrame: Matching rows with categorical labels, float32 values and UTC timestamps.
+    """
+    columns = columns or arrow_schema(dataset_name).names
+    condition = build_filter(start, end, where, partitioned=True)
+
+    table = open_dataset(dataset_name, store_path).to_table(columns=columns, filter=condition)
+    return table.to_pandas()
+
+
+def to_utc(timestamp):
+    timestamp = pd.Timestamp(timestamp)
+    return timestamp.tz_localize('UTC') if timestamp.tzinfo is None else timestamp.tz_convert('UTC')
@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+"""
+Rolling-window statistics (mean, std, min, max, EWMA and spike counts) over the trailing hours of each row
+
+"""
+import numpy as np
+import pandas as pd
+
+
+# Trailing window lengths in hours
+ROLLING_WINDOWS = [6, 24, 168]
+
+HOUR_NS = 3600 * 10**9
+
+# Bytes of hourly grid that _window_scans scans at once
+SCAN_CHUNK_BYTES = 2 ** 27
+
+
+def _steps(times):
+    """Returns epoch hours for a DatetimeIndex, or the values of an integer index of time steps"""
+    if pd.api.types.is_integer_dtype(times):
+        return np.asarray(times, dtype='int64')
+    return times.asi8 // HOUR_NS
+
+
+def _node_hours(index):
+    """Returns (node codes, time steps) for a time index or a (node, time) MultiIndex"""
+    if isinstance(index, pd.MultiIndex):
+        node_codes = pd.factorize(index.get_level_values(0))[0].astype('int64')
+        hours = _steps(index.get_level_values(1))
+    else:
+        node_codes = np.zeros(len(index), dtype='int64')
+        hours = _steps(index)
+    return node_codes, hours
+
+
+def _block_scans(channels, node_codes, positions, n_blocks, window, combine):
+    """Returns the block scan reductions of _window_scans for rows already placed at grid positions, in channels' dtype"""
+    n_channels = channels.shape[1]
+    n_nodes = int(node_codes.max() + 1)
+
+    fill = {'max': -np.inf, 'min': np.inf}.get(combine, 0.0)
+    grid = np.full((n_nodes, n_blocks * window, n_channels), fill, dtype=channels.dtype)
+    grid[node_codes, positions] = channels
+    blocks = grid.reshape(n_nodes, n_blocks, window, n_channels)
+
+    if combine == 'max' or combine == 'min':
+        accumulate = np.maximum.accumulate if combine == 'max' else np.minimum.accumulate
+        prefix = accumulate(blocks, axis=2)
+        suffix = accumulate(blocks[:, :, ::-1], axis=2)[:, :, ::-1]
+        merge = np.maximum if combine == 'max' else np.minimum
+    elif combine == 'sum':
+        prefix = np.cumsum(blocks, axis=2)
+        suffix = np.cumsum(blocks[:, :, ::-1], axis=2)[:, :, ::-1]
+        merge = np.add
+    else:
+        # Decayed sums within a block are rescaled to the block position they are read at
+        steps = np.arange(window)[:, None]
+        prefix = np.cumsum(blocks * combine ** -steps, axis=2) * combine ** steps
+        suffix = np.cumsum((blocks * combine ** (window - 1 - steps))[:, :, ::-1], axis=2)[:, :, ::-1]
+        merge = np.add
+    del grid, blocks
+
+    prefix = prefix.reshape(n_nodes, n_blocks * window, n_channels)
+    suffix = suffix.reshape(n_nodes, n_blocks * window, n_channels)
+
+    reduced = prefix[node_codes, positions]
+
+    # Windows that start inside the previous block also take that block's suffix
+    window_start = positions - window + 1
+    spans_blocks = (window_start >= 0) & (window_start % window != 0)
+    earlier = suffix[node_codes[spans_blocks], window_start[spans_blocks]]
+    if not isinstance(combine, str):
+        earlier = earlier * combine ** (positions[spans_blocks] % window + 1)[:, None]
+    reduced[spans_blocks] = merge(earlier, reduced[spans_blocks])
+
+    return reduced
+
+
+def _window_scans(channels, node_codes, hours, window, combine):
+    """
+    Reduces each channel over the trailing window hours of every row in O(n) with block scans.
+
+    Rows are placed on an hourly grid per node, cut into blocks of window hours aligned to
+    multiples of window since the epoch. A trailing window then covers the end of one block and
+    the start of the next, so it is combined from one suffix scan and one prefix scan (the van
+    Herk / Gil-Werman method). Both scans only read hours inside the window, so the results do
+    not change with where the loaded data starts.
+
+    Nodes are scanned in chunks whose grid fits in SCAN_CHUNK_BYTES, so peak memory stays a few
+    times that however many nodes the panel has. max and min grids are float32 when the channels
+    are exactly float32 (as the float32 source data is), which leaves their results unchanged;
+    sums stay float64 so that the variance and the decayed sums keep their precision.
+
+    Parameters
+    ----------
+    channels : ndarray of shape (n_rows, n_channels)
+        Values to reduce, already filled where missing with the identity of the reduction.
+    combine : str
+        'sum', 'max' or 'min', or a float decay in (0, 1) for exponentially decayed sums, where a
+        value k hours before the row is weighted by decay ** k.
+
+    Returns
+    -------
+    reduced : ndarray of shape (n_rows, n_channels)
+    """
+    first_hour = hours.min() - hours.min() % window
+    positions = hours - first_hour
+    n_blocks = int(positions.max() // window + 1)
+    n_nodes = int(node_codes.max() + 1)
+
+    exact_float32 = (combine == 'max' or combine == 'min') and np.array_equal(channels.astype('float32'), channels)
+    dtype = np.dtype('float32' if exact_float32 else 'float64')
+    nodes_per_chunk = max(SCAN_CHUNK_BYTES // (n_blocks * window * channels.shape[1] * dtype.itemsize), 1)
+
+    if n_nodes <= nodes_per_chunk:
+        return _block_scans(channels.astype(dtype, copy=False), node_codes, positions, n_blocks, window,
+                            combine).astype('float64', copy=False)
+
+    # Rows grouped by node, so each chunk of nodes is one slice
+    order = np.argsort(node_codes, kind='stable')
+    bounds = np.searchsorted(node_codes[order], np.arange(0, n_nodes + nodes_per_chunk, nodes_per_chunk))
+    reduced = np.empty(channels.shape)
+    for chunk, (start, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+        rows = order[start:end]
+        if len(rows):
+            reduced[rows] = _block_scans(channels[rows].astype(dtype), node_codes[rows] - chunk * nodes_per_chunk,
+                                         positions[rows], n_blocks, window, combine)
+
+    return reduced
+
+
+def _scan_channels(values, spike_positions, spike_thresholds):
+    """
+    Returns the channels reduced by the window scans, keyed by reduction.
+
+    'sum' holds the filled values, their squares, presence flags and spike flags; 'max' and 'min'
+    the values with missing hours set to the identity; 'decay' the filled values and presence
+    flags for the EWMA.
+    """
+    present = ~np.isnan(values)
+    filled = np.where(present, values, 0.0)
+
+    spikes = np.concatenate([filled[:, spike_positions] >= threshold for threshold in spike_thresholds], axis=1) \
+        if spike_positions and len(spike_thresholds) else np.zeros((len(values), 0))
+
+    return {'sum': np.concatenate([filled, filled ** 2, present, spikes], axis=1),
+            'max': np.where(present, values, -np.inf),
+            'min': np.where(present, values, np.inf),
+            'decay': np.concatenate([filled, present], axis=1)}
+
+
+def _window_statistics(scans, n):
+    """
+    Returns the statistics of n columns from the scans of one window.
+
+    Returns
+    -------
+    stats : ndarray of shape (n_rows, n, 5)
+        Mean, std, min, max and EWMA of each column, NaN for windows without data (std needs two hours).
+    spike_counts : ndarray of shape (n_rows, n_spike_channels)
+    """
+    sums = scans['sum']
+    total, total_sq, count, spike_counts = sums[:, :n], sums[:, n:2 * n], sums[:, 2 * n:3 * n], sums[:, 3 * n:]
+    decayed = scans['decay']
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total / count
+        variance = np.maximum(total_sq - total * mean, 0) / (count - 1)
+        std = np.where(count > 1, np.sqrt(variance), np.nan)
+        ewma = decayed[:, :n] / decayed[:, n:]
+
+    empty = count == 0
+    stats = np.stack([np.where(empty, np.nan, mean), std, np.where(empty, np.nan, scans['min']),
+                      np.where(empty, np.nan, scans['max']), np.where(empty, np.nan, ewma)], axis=2)
+    return stats, spike_counts
+
+
+def _window_feature_names(columns, window, spike_columns, spike_thresholds, unit):
+    """Returns the names of the statistics of one window, in the order of _window_statistics' flattened results"""
+    names = []
+    for col in columns:
+        names += [f'rolling_{window}{unit}_mean_{col}', f'rolling_{window}{unit}_std_{col}',
+                  f'rolling_{window}{unit}_min_{col}', f'rolling_{window}{unit}_max_{col}', f'ewma_{window}{unit}_{col}']
+    return names + [f'rolling_{window}{unit}_spike_{threshold}_count_{col}'
+                    for threshold in spike_thresholds for col in spike_columns]
+
+
+def rolling_features(df, columns, windows=ROLLING_WINDOWS, spike_columns=(), spike_thresholds=(), unit='hr'):
+    """
+    Computes trailing-window statistics for columns of an hourly DataFrame or (node, hour) panel.
+
+    A row's window covers the hours (t - window, t], by timestamp, so missing hours shorten the
+    window instead of pulling in older data. Windows never cross nodes.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Indexed by unique hourly timestamps, or by a (node, hour) MultiIndex. An integer index of
+        time steps (e.g. epoch 5-minute intervals) is also accepted, with windows in steps.
+    columns : list of str
+        Columns to summarise.
+    windows : list of int
+        Window lengths in hours.
+    spike_columns : list of str
+        Columns (a subset of columns) whose hours at or above each of spike_thresholds are counted.
+    unit : str
+        Label of the window unit in the column names, e.g. 'int' for an index of 5-minute intervals.
+
+    Returns
+    -------
+    rolling_df : DataFrame
+        float32 columns rolling_{w}{unit}_{mean,std,min,max}_{col}, ewma_{w}{unit}_{col} (span of w,
+        weights truncated to the window) and rolling_{w}{unit}_spike_{threshold}_count_{col},
+        indexed like df. Statistics of windows without data are NaN (std needs two hours).
+    """
+    if len(df) == 0:
+        return pd.DataFrame(index=df.index)
+
+    node_codes, hours = _node_hours(df.index)
+    values = df[columns].to_numpy(dtype='float64', na_value=np.nan)
+    spike_positions = [columns.index(col) for col in spike_columns]
+    channels = _scan_channels(values, spike_positions, spike_thresholds)
+
+    names, blocks = [], []
+    for window in windows:
+        decay = 1 - 2.0 / (window + 1)
+        scans = {'sum': _window_scans(channels['sum'], node_codes, hours, window, 'sum'),
+                 'max': _window_scans(channels['max'], node_codes, hours, window, 'max'),
+                 'min': _window_scans(channels['min'], node_codes, hours, window, 'min'),
+                 'decay': _window_scans(channels['decay'], node_codes, hours, window, decay)}
+        stats, spike_counts = _window_statistics(scans, len(columns))
+        names += _window_feature_names(columns, window, spike_columns, spike_thresholds, unit)
+        blocks += [stats.reshape(len(df), -1), spike_counts]
+
+    return pd.DataFrame(np.concatenate(blocks, axis=1).astype('float32'), columns=names, index=df.index)
+
+
+class OnlineBlockScan:
+    """
+    Reduction of channels over a trailing window, updated one hour at a time with the same results as _window_scans, bit for bit.
+
+    Keeps the block scans of _window_scans as state: the latest block of window hours (aligned to
+    multiples of window since the epoch), the running prefix scan of that block and the suffix
+    scans of the block before it, computed once when the block is complete. Prefix and suffix
+    scans are accumulated in the same order as the batch scans, so an update costs a few
+    operations on one row of channels plus one block scan every window hours. Blocks before the
+    first hour added are treated like blocks before the start of the batch data.
+
+    Parameters:
+        window (int): Window length in hours.
+        combine (str or float): As in _window_scans.
+        n_channels (int): Channels per hour.
+    """
+
+    def __init__(self, window, combine, n_channels):
+        self.window = window
+        self.combine = combine
+        self.decayed = not isinstance(combine, str)
+        self.fill = {'max': -np.inf, 'min': np.inf}.get(combine, 0.0)
+        self.block = np.full((window, n_channels), self.fill)
+        self.block_index = None
+        self.first_block = None
+        self.position = -1
+        self.prefix = None
+        self.suffix = None
+
+        if combine == 'max' or combine == 'min':
+            self.accumulate = np.maximum.accumulate if combine == 'max' else np.minimum.accumulate
+            self.merge = np.maximum if combine == 'max' else np.minimum
+        else:
+            self.accumulate = np.cumsum
+            self.merge = np.add
+        if self.decayed:
+            # Weights of _window_scans, computed over the whole block
+            steps = np.arange(window)[:, None]
+            self.prefix_weights = combine ** -steps
+            self.prefix_scales = combine ** steps
+            self.suffix_weights = combine ** (window - 1 - steps)
+            self.earlier_scales = combine ** (np.arange(window) + 1)[:, None]
+
+    def _suffix_scans(self, block):
+        """Returns the suffix scans of a complete block, as _window_scans computes them"""
+        if not self.decayed:
+            return self.accumulate(block[::-1], axis=0)[::-1]
+        return np.cumsum((block * self.suffix_weights)[::-1], axis=0)[::-1]
+
+    def update(self, hour, channels):
+        """
+        Adds the channels of an hour (an integer epoch hour, later than the previous one) and returns the reduction of its window.
+
+        Parameters:
+            hour (int): Hour of channels.
+            channels (ndarray): (n_channels,) values, filled with the identity of the reduction where missing.
+
+        Returns:
+            ndarray: (n_channels,) reduction over the hours (hour - window, hour].
+        """
+        block_index, position = divmod(hour, self.window)
+
+        if self.block_index is None:
+            self.block_index = self.first_block = block_index
+        elif block_index != self.block_index:
+            # The latest block is complete; a block skipped entirely holds only missing hours
+            if block_index != self.block_index + 1:
+                self.block[:] = self.fill
+            self.suffix = self._suffix_scans(self.block)
+            self.block = np.full_like(self.block, self.fill)
+            self.block_index = block_index
+            self.position = -1
+            self.prefix = None
+        self.block[position] = channels
+
+        # Extend the prefix scan over this hour and any missing hours before it in the block
+        for i in range(self.position + 1, position + 1):
+            row = self.block[i] * self.prefix_weights[i] if self.decayed else self.block[i].copy()
+            self.prefix = row if self.prefix is None else self.merge(self.prefix, row)
+        self.position = position
+
+        reduced = self.prefix * self.prefix_scales[position] if self.decayed else self.prefix
+
+        # Windows that start inside the previous block also take that block's suffix
+        if position != self.window - 1 and block_index - 1 >= self.first_block:
+            earlier = self.suffix[position + 1]
+            if self.decayed:
+                earlier = earlier * self.earlier_scales[position]
+            reduced = self.merge(earlier, reduced)
+
+        return reduced
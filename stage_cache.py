@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+Caches the output of DataCleaning stages keyed by the content of their raw inputs and their code
+
+"""
+import functools
+import hashlib
+import inspect
+import json
+import os
+
+import pandas as pd
+
+from raw_store import RAW_STORE_PATH, partition_files
+
+
+CACHE_PATH = 'Cleaned_Data/stage_cache'
+
+# Bump to invalidate every cached stage, e.g. after upgrading a library the stages call into.
+# Code and settings of this project that a stage uses are part of its key already
+CACHE_VERSION = 1
+
+# Outputs kept per stage, across all arguments. The least recently used are removed first
+MAX_OUTPUTS_PER_STAGE = 4
+
+# Modules in this folder are the project's own code, whose source is part of the cache key
+PROJECT_PATH = os.path.dirname(os.path.abspath(__file__))
+
+# Global values whose repr is part of the cache key, e.g. DataCleaning.NODE
+SETTING_TYPES = (str, int, float, bool, tuple, list, dict, frozenset, type(None))
+
+
+class FileHasher:
+    """
+    Content hashes of raw store files, remembered by (size, mtime) so unchanged files are only read once.
+
+    Parameters:
+        memo_path (str): json file holding the remembered hashes.
+    """
+
+    def __init__(self, memo_path):
+        self.memo_path = memo_path
+        self.changed = False
+
+        if os.path.exists(memo_path):
+            with open(memo_path) as f:
+                self.memo = json.load(f)
+        else:
+            self.memo = {}
+
+    def hash_file(self, path):
+        stat = os.stat(path)
+        remembered = self.memo.get(path)
+        if remembered is not None and remembered[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return remembered[2]
+
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+
+        self.memo[path] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        self.changed = True
+        return digest.hexdigest()
+
+    def save(self):
+        if self.changed:
+            temp_path = self.memo_path + '.tmp'
+            with open(temp_path, 'w') as f:
+                json.dump(self.memo, f)
+            os.replace(temp_path, self.memo_path)
+            self.changed = False
+
+
+def _project_module(value):
+    """Returns the project module value is (or is defined in), or None for other values and libraries"""
+    module = value if inspect.ismodule(value) else inspect.getmodule(value) \
+        if inspect.isfunction(value) or inspect.isclass(value) else None
+    path = getattr(module, '__file__', None)
+    if path is None or os.path.dirname(os.path.abspath(path)) != PROJECT_PATH:
+        return None
+    return module
+
+
+def _code_names(code):
+    """Returns the global and attribute names used by a code object and the code nested in it"""
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            names |= _code_names(const)
+    return names
+
+
+def _dependencies(func):
+    """
+    Returns what a stage's output depends on besides its arguments and raw inputs.
+
+    Returns
+    -------
+    functions : list of function
+        The stage and the functions of its own module it calls, directly or not.
+    modules : list of module
+        Other project modules those functions use, plus every project module those use in turn.
+    settings : list of str
+        Module-level values (e.g. NODE) those functions read, by name. Their values are read
+        when the stage is called.
+    """
+    functions, modules, settings = {}, {}, set()
+    pending = [func]
+    while pending:
+        current = pending.pop()
+        if current.__qualname__ in functions:
+            continue
+        functions[current.__qualname__] = current
+        for name in _code_names(current.__code__):
+            if name not in current.__globals__:
+                continue
+            value = current.__globals__[name]
+            module = _project_module(value)
+            if inspect.isfunction(value) and value.__module__ == func.__module__:
+                pending.append(inspect.unwrap(value))
+            elif module is not None and module.__name__ != func.__module__:
+                modules[module.__name__] = module
+            elif isinstance(value, SETTING_TYPES):
+                settings.add(name)
+
+    # Project modules used by the helper modules, e.g. raw_store under hourly_aggregation
+    pending = list(modules.values())
+    while pending:
+        for value in list(vars(pending.pop()).values()):
+            module = _project_module(value)
+            if module is not None and module.__name__ not in modules and module.__name__ != func.__module__:
+                modules[module.__name__] = module
+                pending.append(module)
+
+    return list(functions.values()), [modules[name] for name in sorted(modules)], sorted(settings)
+
+
+def _evict(cache_path, stage_name, keep):
+    """Removes all but the keep most recently used outputs of a stage"""
+    outputs = [os.path.join(cache_path, f) for f in os.listdir(cache_path)
+               if f.startswith(stage_name + '-') and f.endswith('.parquet')]
+    for path in sorted(outputs, key=os.path.getmtime, reverse=True)[keep:]:
+        os.remove(path)
+
+
+def cached_stage(*dataset_names, cache_path=CACHE_PATH, store_path=RAW_STORE_PATH):
+    """
+    Decorator that persists a stage's DataFrame output as Parquet and reuses it while its inputs are unchanged.
+
+    The cache key combines a content hash of the raw store partitions the stage reads (only the months
+    overlapping its start / end arguments), the stage's arguments, the source code of the stage,
+    of the functions of its module it calls and of the project modules they use (e.g.
+    hourly_aggregation, fast_pivot, raw_store), and the values of the module-level settings they
+    read (e.g. NODE). Up to MAX_OUTPUTS_PER_STAGE outputs are kept per stage, whatever their
+    arguments, so runs with a new start each time (--incremental) do not pile up outputs.
+
+    Parameters:
+        dataset_names (str): Raw store datasets the stage reads, e.g. 'PRC_INTVL_LMP'.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+        functions, modules, settings = _dependencies(func)
+        code_hash = hashlib.blake2b(digest_size=8)
+        for dependency in functions + modules:
+            code_hash.update(inspect.getsource(dependency).encode())
+        code_hash = code_hash.hexdigest()
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = bound.arguments
+
+            # Settings are read on every call, so changing e.g. DataCleaning.NODE at runtime changes the key
+            setting_values = [(name, func.__globals__[name]) for name in settings]
+            args_hash = hashlib.blake2b(repr((sorted(arguments.items()), setting_values)).encode(),
+                                        digest_size=8).hexdigest()
+
+            os.makedirs(cache_path, exist_ok=True)
+            hasher = FileHasher(os.path.join(cache_path, 'file_hashes.json'))
+            inputs = hashlib.blake2b(f'{CACHE_VERSION}|{code_hash}'.encode(), digest_size=16)
+            for dataset_name in dataset_names:
+                for path in partition_files(dataset_name, arguments.get('start'), arguments.get('end'), store_path):
+                    inputs.update(f'{os.path.relpath(path, store_path)}={hasher.hash_file(path)}'.encode())
+            hasher.save()
+
+            path = os.path.join(cache_path, f'{func.__name__}-{args_hash}-{inputs.hexdigest()}.parquet')
+
+            if os.path.exists(path):
+                print("Reusing cached " + func.__name__)
+                # Mark the output as recently used, so eviction keeps it
+                os.utime(path)
+                return pd.read_parquet(path)
+
+            result = func(*args, **kwargs)
+
+            # Parquet only round-trips plain column labels (pivots leave a CategoricalIndex behind)
+            result.columns = [str(col) for col in result.columns]
+
+            result.to_parquet(path + '.tmp')
+            os.replace(path + '.tmp', path)
+            _evict(cache_path, func.__name__, MAX_OUTPUTS_PER_STAGE)
+
+            return result
+
+        return wrapper
+
+    return decorator
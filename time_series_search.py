@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""
+Parallel randomized hyperparameter search over expanding-window time-series folds, sharing the
+training data with worker processes through shared memory
+
+"""
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+from sklearn import metrics
+from sklearn.base import clone
+from sklearn.model_selection import ParameterSampler, TimeSeriesSplit
+
+
+# Arrays attached by each worker process: name -> (SharedMemory, ndarray view)
+_shared_arrays = {}
+
+
+def _share_array(array):
+    """Copies array into a new shared memory block and returns (block, spec), where spec lets a worker attach to it"""
+    array = np.ascontiguousarray(array)
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+    return block, (block.name, array.shape, array.dtype.str)
+
+
+def _attach_arrays(specs):
+    """Worker initializer: maps every shared array into this process once, without copying"""
+    for key, (name, shape, dtype) in specs.items():
+        block = shared_memory.SharedMemory(name=name)
+        _shared_arrays[key] = (block, np.ndarray(shape, dtype=dtype, buffer=block.buf))
+
+
+def expanding_window_folds(n_samples, n_splits=5, gap=2):
+    """
+    Returns (train_end, test_start, test_end) row bounds of expanding-window folds over time-ordered samples.
+
+    Each fold trains on every row before train_end and is scored on the next block of rows. gap
+    rows are left out between them so that targets observed after the training rows (e.g. the
+    price 2 hours ahead) never appear as training labels.
+    """
+    splitter = TimeSeriesSplit(n_splits=n_splits, gap=gap)
+    return [(int(train[-1]) + 1, int(test[0]), int(test[-1]) + 1) for train, test in splitter.split(np.empty((n_samples, 1)))]
+
+
+def _budget_params(estimator, params, budget):
+    """Returns params with n_estimators (from params or the estimator) scaled by budget, keeping at least one tree"""
+    n_estimators = params.get('n_estimators', estimator.get_params().get('n_estimators'))
+    if budget >= 1 or n_estimators is None:
+        return params
+    return dict(params, n_estimators=max(1, int(round(n_estimators * budget))))
+
+
+def _fit_and_score(estimator, params, fold, budget=1.0, early_stopping_rounds=None, gap=0):
+    """
+    Fits a copy of estimator with params on one fold of the shared arrays and returns its RMSE on the fold's test rows.
+
+    With a budget below 1 the model is fit on only the most recent budget share of the fold's
+    training rows, with n_estimators scaled the same way. With early_stopping_rounds (XGBoost) the
+    last tenth of those rows is held out as a time-ordered validation slice for early stopping,
+    with gap rows left out before it as between the fold's training and test rows.
+    """
+    X, y = _shared_arrays['X'][1], _shared_arrays['y'][1]
+    train_end, test_start, test_end = fold
+    train_start = train_end - max(int(train_end * budget), 2)
+
+    start_time = time.perf_counter()
+    model = clone(estimator).set_params(**_budget_params(estimator, params, budget))
+    if early_stopping_rounds:
+        eval_start = train_end - max((train_end - train_start) // 10, 1)
+        fit_end = max(eval_start - gap, train_start + 1)
+        model.set_params(early_stopping_rounds=early_stopping_rounds)
+        model.fit(X[train_start:fit_end], y[train_start:fit_end],
+                  eval_set=[(X[eval_start:train_end], y[eval_start:train_end])], verbose=False)
+    else:
+        model.fit(X[train_start:train_end], y[train_start:train_end])
+    rmse = np.sqrt(metrics.mean_squared_error(y[test_start:test_end], model.predict(X[test_start:test_end])))
+
+    return rmse, time.perf_counter() - start_time
+
+
+@contextmanager
+def _shared_pool(X, y, max_workers=None):
+    """Copies X and y into shared memory and yields a process pool whose workers have them attached"""
+    X_block, X_spec = _share_array(X)
+    y_block, y_spec = _share_array(y)
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(), initializer=_attach_arrays,
+                                 initargs=({'X': X_spec, 'y': y_spec},)) as executor:
+            yield executor
+    finally:
+        for block in (X_block, y_block):
+            block.close()
+            block.unlink()
+
+
+def _score_candidates(executor, estimator, candidates, folds, budget=1.0, early_stopping_rounds=None, gap=0):
+    """Runs every (candidate, fold) pair as a task and returns (rmse, fit seconds) arrays of shape (n_candidates, n_folds)"""
+    futures = [executor.submit(_fit_and_score, estimator, params, fold, budget, early_stopping_rounds, gap)
+               for params in candidates for fold in folds]
+    scores = [future.result() for future in futures]
+
+    rmse = np.array([score for score, _ in scores]).reshape(len(candidates), len(folds))
+    seconds = np.array([fit_time for _, fit_time in scores]).reshape(len(candidates), len(folds))
+    return rmse, seconds
+
+
+def _prepare(estimator, X_train, y_train):
+    """Returns float arrays of the training data and a copy of estimator limited to one thread"""
+    X = np.asarray(X_train, dtype='float32')
+    y = np.asarray(y_train, dtype='float64')
+    if 'n_jobs' in estimator.get_params():
+        estimator = clone(estimator).set_params(n_jobs=1)
+    return estimator, X, y
+
+
+def time_series_search(estimator, X_train, y_train, param_distributions, n_iter=50, n_splits=5, gap=2, seed=None,
+                       max_workers=None):
+    """
+    Randomized search over param_distributions scored on expanding-window time-series folds.
+
+    Replaces RandomizedSearchCV with shuffled k-fold, which trained on hours after the ones it
+    scored. Every (candidate, fold) pair is an independent task spread over all cores. X_train and
+    y_train are copied once into shared memory and each worker maps them on start-up, so tasks
+    only carry the estimator, the parameters and the fold bounds.
+
+    Parameters
+    ----------
+    estimator : estimator object
+        Unfitted scikit-learn compatible regressor. Its own threading (n_jobs) is set to 1 so
+        the worker processes do not oversubscribe the cores.
+    X_train : array-like of shape (n_samples, n_features)
+        Training inputs, in time order.
+    y_train : array-like of shape (n_samples,)
+        Target values, in time order.
+    param_distributions : dict
+        Parameter names mapped to lists or distributions to sample, as for RandomizedSearchCV.
+    n_iter : int
+        Number of candidates sampled.
+    n_splits : int
+        Number of expanding-window folds.
+    gap : int
+        Rows left out between each fold's training and test rows.
+    seed : int
+        Seed of the candidate sampling.
+    max_workers : int
+        Worker processes. Defaults to the number of cores.
+
+    Returns
+    -------
+    best_params : dict
+        Candidate with the lowest mean RMSE across folds.
+    results : DataFrame
+        One row per candidate with its parameters, mean and std RMSE, per-fold RMSE and total
+        fit time, sorted best first.
+    """
+    estimator, X, y = _prepare(estimator, X_train, y_train)
+    candidates = list(ParameterSampler(param_distributions, n_iter=n_iter, random_state=seed))
+    folds = expanding_window_folds(len(X), n_splits, gap)
+
+    with _shared_pool(X, y, max_workers) as executor:
+        rmse, seconds = _score_candidates(executor, estimator, candidates, folds)
+
+    results = pd.DataFrame({'params': candidates,
+                            'mean_rmse': rmse.mean(axis=1),
+                            'std_rmse': rmse.std(axis=1),
+                            'fit_seconds': seconds.sum(axis=1)})
+    for fold in range(len(folds)):
+        results[f'fold_{fold}_rmse'] = rmse[:, fold]
+    results = results.sort_values('mean_rmse').reset_index(drop=True)
+
+    best_params = results.loc[0, 'params']
+    print("Best hyperparameters found during time-series search:")
+    print(best_params)
+
+    return best_params, results
+
+
+def successive_halving_search(estimator, X_train, y_train, param_distributions, n_candidates=128, factor=3,
+                              n_splits=5, gap=2, early_stopping_rounds=None, seed=None, max_workers=None):
+    """
+    Successive-halving search: many candidates on small budgets, only the best promoted to the full budget.
+
+    Rung k scores the surviving candidates on the same expanding-window folds as
+    time_series_search, with a budget of factor ** (k - n_rungs + 1): each fit uses that share
+    of the most recent training rows and of the candidate's n_estimators. The best 1 / factor of
+    the candidates move up a rung until the last one is scored at the full budget. Since a fit
+    costs roughly rows x trees, a candidate at budget 1/9 costs about 1/81 of a full fit, so 128
+    candidates (128, 42, 14, 4 then 1 at full budget) cost less than scoring 5 candidates at the
+    full budget.
+
+    Parameters
+    ----------
+    estimator : estimator object
+        Unfitted scikit-learn compatible regressor.
+    X_train : array-like of shape (n_samples, n_features)
+        Training inputs, in time order.
+    y_train : array-like of shape (n_samples,)
+        Target values, in time order.
+    param_distributions : dict
+        Parameter names mapped to lists or distributions to sample, as for RandomizedSearchCV.
+    n_candidates : int
+        Candidates sampled for the first rung (fewer if a grid of lists is smaller).
+    factor : int
+        Share of candidates kept (1 / factor) and budget growth (x factor) between rungs.
+    n_splits : int
+        Number of expanding-window folds.
+    gap : int
+        Rows left out between each fold's training and test rows, and before the early stopping rows.
+    early_stopping_rounds : int
+        For XGBoost: stop adding trees once the last tenth of the training rows has not improved
+        for this many rounds.
+    seed : int
+        Seed of the candidate sampling.
+    max_workers : int
+        Worker processes. Defaults to the number of cores.
+
+    Returns
+    -------
+    best_params : dict
+        Best candidate of the final, full-budget rung.
+    results : DataFrame
+        One row per candidate and rung it reached, with the rung's budget, mean and std RMSE and
+        fit seconds, sorted by rung (last first) then RMSE.
+    """
+    estimator, X, y = _prepare(estimator, X_train, y_train)
+    candidates = list(ParameterSampler(param_distributions, n_iter=n_candidates, random_state=seed))
+    folds = expanding_window_folds(len(X), n_splits, gap)
+
+    # Add rungs while the last one still has a candidate left to score
+    n_rungs = 1
+    while len(candidates) // factor ** n_rungs >= 1:
+        n_rungs += 1
+    survivors = list(range(len(candidates)))
+    records = []
+
+    with _shared_pool(X, y, max_workers) as executor:
+        for rung in range(n_rungs):
+            budget = float(factor) ** (rung - n_rungs + 1)
+            rmse, seconds = _score_candidates(executor, estimator, [candidates[i] for i in survivors], folds,
+                                              budget, early_stopping_rounds, gap)
+            mean_rmse = rmse.mean(axis=1)
+
+            for i, candidate in enumerate(survivors):
+                records.append({'params': candidates[candidate], 'rung': rung, 'budget': budget,
+                                'mean_rmse': mean_rmse[i], 'std_rmse': rmse[i].std(),
+                                'fit_seconds': seconds[i].sum()})
+            print(f"successive_halving_search: rung {rung} scored {len(survivors)} candidates at budget "
+                  f"{budget:.3f} in {seconds.sum():.1f}s of fitting")
+
+            # Promote the best 1 / factor of the candidates (at least one)
+            keep = max(len(survivors) // factor, 1)
+            survivors = [survivors[i] for i in np.argsort(mean_rmse, kind='stable')[:keep]]
+
+    results = pd.DataFrame(records).sort_values(['rung', 'mean_rmse'], ascending=[False, True]).reset_index(drop=True)
+
+    best_params = results.loc[0, 'params']
+    print("Best hyperparameters found during successive halving:")
+    print(best_params)
+
+    return best_params, results
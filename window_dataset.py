@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Sliding-window (RNN) datasets built as strided views over an HourlyPanel
+
+"""
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+# Hours checked at a time when building the valid mask
+CHUNK_ROWS = 1 << 16
+
+
+def sliding_windows(panel, features, target, window_size, prediction_gap=2):
+    """
+    Builds every input window and its target from a panel without copying the data.
+
+    Sample i uses the window_size consecutive hours ending at row i + window_size - 1 as input and
+    the target prediction_gap hours after that last hour as output. Windows are consecutive hours,
+    not consecutive rows, so they never bridge a missing hour; samples touching a missing hour or a
+    NaN are marked invalid instead of being dropped, which keeps sample i aligned with row i.
+
+    Parameters
+    ----------
+    panel : HourlyPanel
+        Hourly data holding features and target.
+    features : list of str
+        Input columns, in the order of the last axis of X.
+    target : str
+        Column predicted prediction_gap hours after each window.
+    window_size : int
+        Hours in each input window.
+    prediction_gap : int
+        Hours between the last input hour and the target hour.
+
+    Returns
+    -------
+    X : ndarray of shape (n_samples, window_size, n_features)
+        Read-only strided view of the feature columns (a single copy of them if they are not
+        adjacent in the panel).
+    y : ndarray of shape (n_samples,)
+        View of the target column.
+    valid : ndarray of shape (n_samples,)
+        True where every input hour and the target hour have data. X[valid] and y[valid] give
+        the training arrays.
+    target_offsets : ndarray of shape (n_samples,)
+        Row offset in panel of each sample's target hour, e.g. for panel.index()[target_offsets].
+    """
+    n_samples = max(len(panel) - window_size - prediction_gap + 1, 0)
+
+    inputs = panel.columns_array(features)
+    X = sliding_window_view(inputs, window_size, axis=0).transpose(0, 2, 1)[:n_samples]
+
+    target_offsets = np.arange(n_samples) + window_size - 1 + prediction_gap
+    y = panel.column(target)[window_size - 1 + prediction_gap:][:n_samples]
+
+    return X, y, window_mask(panel, features, target, window_size, prediction_gap), target_offsets
+
+
+def window_mask(panel, features, target, window_size, prediction_gap=2, chunk_rows=CHUNK_ROWS):
+    """
+    Returns the valid mask of sliding_windows without building the windows.
+
+    The panel is scanned chunk_rows hours at a time, so a memory-mapped panel is read once in
+    sequence and never held in memory whole.
+    """
+    n_samples = max(len(panel) - window_size - prediction_gap + 1, 0)
+    positions = [panel.columns.index(col) for col in features]
+    target_position = panel.columns.index(target)
+
+    hour_ok = np.empty(len(panel), dtype=bool)
+    target_ok = np.empty(len(panel), dtype=bool)
+    for start in range(0, len(panel), chunk_rows):
+        chunk = np.asarray(panel.values[start:start + chunk_rows])
+        hour_ok[start:start + chunk_rows] = ~np.isnan(chunk[:, positions]).any(axis=1)
+        target_ok[start:start + chunk_rows] = ~np.isnan(chunk[:, target_position])
+    hour_ok &= panel.valid
+
+    # A window is valid when all of its hours are, counted with a running sum over the hours
+    ok_count = np.concatenate([[0], np.cumsum(hour_ok)])
+    window_ok = (ok_count[window_size:] - ok_count[:-window_size]) == window_size
+
+    target_offsets = np.arange(n_samples) + window_size - 1 + prediction_gap
+    return window_ok[:n_samples] & panel.valid[target_offsets] & target_ok[target_offsets]
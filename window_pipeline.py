@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming tf.data pipelines of RNN windows, read batch by batch from an HourlyPanel (in memory or memory-mapped)
+
+"""
+import numpy as np
+import tensorflow as tf
+
+from window_dataset import window_mask
+
+
+def _epoch_batches(samples, batch_size, shuffle_block, rng):
+    """
+    Yields the sample offsets of each batch for one epoch.
+
+    Without shuffle_block the samples keep their time order. Otherwise samples are cut into
+    blocks of shuffle_block consecutive samples, the blocks are visited in random order and the
+    samples are shuffled within each block, so a batch only reads from a small stretch of the
+    series.
+    """
+    if shuffle_block:
+        blocks = [samples[start:start + shuffle_block] for start in range(0, len(samples), shuffle_block)]
+        samples = np.concatenate([rng.permutation(blocks[i]) for i in rng.permutation(len(blocks))]) \
+            if blocks else samples
+
+    for start in range(0, len(samples), batch_size):
+        yield samples[start:start + batch_size]
+
+
+def _gather_windows(values, positions, target_position, offsets, window_size, prediction_gap):
+    """Copies the windows starting at offsets, with their targets, out of values as (batch, window_size, n_features) and (batch, 1)"""
+    rows = (offsets[:, None] + np.arange(window_size)).ravel()
+    X = values[rows][:, positions].reshape(len(offsets), window_size, len(positions))
+    y = values[offsets + window_size - 1 + prediction_gap, target_position].reshape(-1, 1)
+    return X.astype('float32', copy=False), y.astype('float32', copy=False)
+
+
+def window_pipeline(panel, features, target, window_size, prediction_gap=2, sample_mask=None, batch_size=32,
+                    shuffle_block=None, seed=None, prefetch=tf.data.AUTOTUNE):
+    """
+    Builds a tf.data.Dataset of (X, y) batches for the windows sliding_windows would give, without materialising them.
+
+    Only the valid sample offsets are held in memory. Each batch gathers its windows from the
+    panel's float32 values when it is requested, so the values can be a memory-mapped file
+    (HourlyPanel.load) larger than memory. Batches are prepared in parallel with training
+    through prefetch, and the shuffle order changes every epoch.
+
+    Parameters
+    ----------
+    panel : HourlyPanel
+        Hourly data holding features and target.
+    features : list of str
+        Input columns, in the order of the last axis of X.
+    target : str
+        Column predicted prediction_gap hours after each window.
+    window_size : int
+        Hours in each input window.
+    prediction_gap : int
+        Hours between the last input hour and the target hour.
+    sample_mask : ndarray of bool
+        Samples to use, e.g. a train split over the samples of sliding_windows. Invalid samples
+        are always skipped.
+    batch_size : int
+        Windows per batch.
+    shuffle_block : int
+        Consecutive samples per shuffle block, e.g. 24 * 7 for weekly blocks. None keeps time order
+        (for validation and test sets).
+    seed : int
+        Seed of the shuffle order.
+    prefetch : int
+        Batches to prepare ahead of the model, tf.data.AUTOTUNE by default.
+
+    Returns
+    -------
+    dataset : tf.data.Dataset
+        Batches of X with shape (batch, window_size, n_features) and y with shape (batch, 1), both
+        float32, which can be passed straight to model.fit, evaluate and predict.
+    """
+    valid = window_mask(panel, features, target, window_size, prediction_gap)
+    if sample_mask is not None:
+        valid = valid & sample_mask
+    samples = np.flatnonzero(valid)
+
+    positions = [panel.columns.index(col) for col in features]
+    target_position = panel.columns.index(target)
+    rng = np.random.default_rng(seed)
+
+    # The generator is called again at the start of each epoch, drawing a new shuffle order
+    offsets = tf.data.Dataset.from_generator(lambda: _epoch_batches(samples, batch_size, shuffle_block, rng),
+                                             output_signature=tf.TensorSpec(shape=(None,), dtype=tf.int64))
+
+    def read_batch(batch_offsets):
+        return _gather_windows(panel.values, positions, target_position, batch_offsets, window_size, prediction_gap)
+
+    def gather(batch_offsets):
+        X, y = tf.numpy_function(read_batch, [batch_offsets], [tf.float32, tf.float32])
+        X.set_shape((None, window_size, len(features)))
+        y.set_shape((None, 1))
+        return X, y
+
+    return offsets.map(gather, num_parallel_calls=tf.data.AUTOTUNE, deterministic=True).prefetch(prefetch)